@@ -0,0 +1,163 @@
+"""Benchmark gh commands against a local fake GitHub API.
+
+Starts the fake GraphQL server from fakegh.py with synthetic repositories,
+runs real gh invocations against it and reports wall time, requests,
+transferred bytes and peak RSS per command:
+
+    python bench/commands.py [-n RUNS] [--issues N] [--prs N] [--latency MS]
+
+Results are compared against a stored baseline. Use --save to record the
+current results as new baseline.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakegh import FakeGitHub, World
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_baseline = os.path.join(root, 'bench', 'baseline.json')
+
+cases = {
+    'pr list': ["pr", "list", "bench/repo0", "--event", "updated"],
+    'pr list ndjson': ["--format", "ndjson", "pr", "list", "bench/repo0",
+                       "--event", "updated"],
+    'pr userlist': ["pr", "userlist", "user1"],
+    'issue list': ["issue", "list", "--states", "all", "bench/repo0"],
+    'issue list org': ["issue", "list", "--states", "all", "--org", "bench"],
+    'user interactions': ["user", "interactions", "user1"],
+    'branches prune_merged': ["branches", "prune_merged", "--dry",
+                              "--path", "{git}", "origin"],
+    'branches prune_merged local': ["branches", "prune_merged", "--dry",
+                                    "--local-branches", "--path", "{git}",
+                                    "origin"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=3)
+    parser.add_argument("--repos", type=int, default=1)
+    parser.add_argument("--issues", type=int, default=1000)
+    parser.add_argument("--prs", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=300)
+    parser.add_argument("--local-branches", type=int, default=30,
+                        help="branches in the local git checkout")
+    parser.add_argument("--latency", type=float, default=20,
+                        help="latency added per request in milliseconds")
+    parser.add_argument("--baseline", default=default_baseline)
+    parser.add_argument("--save", default=False, action='store_true',
+                        help="store results as new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as regression")
+    parser.add_argument("case", nargs="*", help="cases to run (default all)")
+    opts = parser.parse_args()
+
+    world = World.generate(repos=opts.repos, issues=opts.issues, prs=opts.prs,
+                           branches=opts.branches)
+    server = FakeGitHub(world, latency=opts.latency / 1000).start()
+
+    baseline = {}
+    if os.path.exists(opts.baseline):
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = environment(tmp, server.url)
+        git_dir = make_checkout(tmp, opts.local_branches)
+
+        for name, args in cases.items():
+            if opts.case and name not in opts.case:
+                continue
+            args = [a.format(git=git_dir) for a in args]
+
+            # first run compiles and caches the GraphQL operations
+            run(args, env)
+            runs = []
+            for _ in range(opts.runs):
+                server.reset_stats()
+                wall, rss = run(args, env)
+                runs.append(dict(server.stats, wall=wall, rss=rss))
+
+            results[name] = result = {
+                'wall': statistics.median(r['wall'] for r in runs),
+                'requests': runs[-1]['requests'],
+                'bytes': runs[-1]['bytes_received'] + runs[-1]['bytes_sent'],
+                'rss': max(r['rss'] for r in runs),
+            }
+            report(name, result, baseline.get(name), opts.threshold)
+
+    server.stop()
+
+    if opts.save:
+        baseline.update(results)
+        with open(opts.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def environment(tmp, url):
+    token = os.path.join(tmp, 'token')
+    with open(token, 'w') as f:
+        f.write('bench')
+    return dict(os.environ,
+                PYTHONPATH=root,
+                GH_API_URL=url,
+                XDG_CACHE_HOME=os.path.join(tmp, 'cache'),
+                XDG_DATA_HOME=os.path.join(tmp, 'data'),
+                XDG_RUNTIME_DIR=os.path.join(tmp, 'run'),
+                BENCH_TOKEN=token)
+
+
+def make_checkout(tmp, branches):
+    path = os.path.join(tmp, 'checkout')
+    git = ["git", "-C", path, "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(["git", "init", "-q", path], check=True)
+    subprocess.run(git + ["commit", "-q", "--allow-empty", "-m", "init"], check=True)
+    subprocess.run(git + ["remote", "add", "origin",
+                          "git@github.com:bench/repo0.git"], check=True)
+    updates = "".join(f"create refs/heads/branch-{i} HEAD\n" for i in range(branches))
+    subprocess.run(git + ["update-ref", "--stdin"], input=updates.encode(),
+                   check=True)
+    return path
+
+
+def run(args, env):
+    """Runs gh, returns the wall time in seconds and peak RSS in KiB."""
+
+    cmd = [sys.executable, "-m", "gh", "--token", env['BENCH_TOKEN']] + args
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        sys.stderr.write(stderr.decode(errors='replace'))
+        raise Exception(f"gh {' '.join(args)} failed")
+    return wall, usage.ru_maxrss
+
+
+def report(name, result, base, threshold):
+    line = (f"{name:<30} {result['wall'] * 1000:8.1f}ms "
+            f"{result['requests']:5d} req {result['bytes'] / 1024:9.1f}KiB "
+            f"{result['rss'] / 1024:7.1f}MiB")
+    if base:
+        delta = result['wall'] / base['wall'] - 1
+        line += f"  {delta * 100:+6.1f}%"
+        if delta > threshold:
+            line += " REGRESSION"
+    print(line, flush=True)
+
+
+if __name__ == '__main__':
+    main()
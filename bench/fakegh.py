@@ -0,0 +1,676 @@
+"""In-process stand-in for the GitHub GraphQL API.
+
+Serves synthetic repositories (issues, pull requests, branches, labels and
+cross references) over HTTP, so gh commands can be benchmarked without
+network access or rate limits:
+
+    server = FakeGitHub(World.generate(issues=2000, prs=2000), latency=0.05)
+    server.start()
+    # GH_API_URL=server.url gh ...
+    server.stop()
+
+Queries are evaluated directly against the data model. Fields are looked
+up by name on the current object, and methods are called with the field
+arguments. There is no schema validation. Unknown fields resolve to null.
+"""
+
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# data model
+
+def fmt_time(d):
+    return d.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_time(s):
+    s = s.rstrip('Z')
+    return datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%S")
+
+
+class Node:
+    typename = None
+    interfaces = ()
+
+
+class Connection:
+    """Cursor based pagination over a list, cursors are list offsets."""
+
+    def __init__(self, items, first=None, after=None, last=None):
+        start = int(after) if after else 0
+        end = len(items)
+        if first is not None:
+            end = min(end, start + first)
+        page = items[start:end]
+        if last is not None:
+            page = page[-last:]
+            start = end - len(page)
+
+        self.totalCount = len(items)
+        self.issueCount = len(items)
+        self.nodes = page
+        self.edges = [{'cursor': str(start + i + 1), 'node': n}
+                      for i, n in enumerate(page)]
+        self.pageInfo = {
+            'hasNextPage': end < len(items),
+            'endCursor': str(end) if page else after,
+        }
+
+
+class User(Node):
+    typename = 'User'
+
+    def __init__(self, world, login):
+        self.world = world
+        self.login = login
+
+    def pullRequests(self, first=None, after=None, states=None, labels=None,
+                     **kwargs):
+        prs = [pr for pr in self.world.prs()
+               if pr.author is self and match_state(pr, states)
+               and match_labels(pr, labels)]
+        return Connection(prs, first, after)
+
+    def repositories(self, first=None, after=None, **kwargs):
+        repos = sorted((r for r in self.world.repos.values() if r.owner is self),
+                       key=lambda r: r.name)
+        return Connection(repos, first, after)
+
+
+class Label(Node):
+    typename = 'Label'
+
+    def __init__(self, repo, name):
+        self.id = f"L_{repo.owner.login}_{repo.name}_{name}"
+        self.name = name
+
+
+class Item(Node):
+    """Fields shared by issues and pull requests."""
+
+    def __init__(self, repo, number, author, created, updated, state, labels):
+        self.repository = repo
+        self.number = number
+        self.id = f"{self.typename}_{repo.owner.login}_{repo.name}_{number}"
+        self.author = author
+        self.title = f"{self.typename} {number} of {repo.name}"
+        self.bodyText = f"Synthetic {self.typename} {number}\n" * 5
+        self.createdAt = fmt_time(created)
+        self.updatedAt = fmt_time(updated)
+        self.closedAt = None if state == 'OPEN' else self.updatedAt
+        self.state = state
+        self.item_labels = labels
+        self.item_participants = [author]
+        self.references = []
+        self.url = (f"https://github.com/{repo.owner.login}/{repo.name}/"
+                    f"{self.path}/{number}")
+        self.permalink = self.url
+
+    def labels(self, first=None, after=None, **kwargs):
+        return Connection(self.item_labels, first, after)
+
+    def participants(self, first=None, after=None, **kwargs):
+        return Connection(self.item_participants, first, after)
+
+    def assignees(self, first=None, after=None, **kwargs):
+        return Connection([], first, after)
+
+    def projectCards(self, first=None, after=None, **kwargs):
+        return Connection([], first, after)
+
+    def timelineItems(self, first=None, after=None, last=None, **kwargs):
+        events = [CrossReferencedEvent(source, self) for source in self.references]
+        return Connection(events, first, after, last)
+
+
+class Issue(Item):
+    typename = 'Issue'
+    path = 'issues'
+
+
+class PullRequest(Item):
+    typename = 'PullRequest'
+    path = 'pull'
+
+    def __init__(self, *args, branch=None, **kwargs):
+        super(PullRequest, self).__init__(*args, **kwargs)
+        self.headRefName = branch
+        self.mergeable = 'MERGEABLE' if self.state == 'OPEN' else 'UNKNOWN'
+        self.mergedAt = self.closedAt if self.state == 'MERGED' else None
+        self.mergeCommit = None
+        if self.state == 'MERGED':
+            self.mergeCommit = {'committedDate': self.mergedAt,
+                                'oid': f"{self.number:040x}"}
+
+    def reviews(self, first=None, last=None, **kwargs):
+        return Connection([], first, None, last)
+
+    def commits(self, first=None, last=None, **kwargs):
+        return Connection([], first, None, last)
+
+
+class CrossReferencedEvent(Node):
+    typename = 'CrossReferencedEvent'
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+
+
+class Ref(Node):
+    typename = 'Ref'
+
+    def __init__(self, repo, name):
+        self.repo = repo
+        self.id = f"REF_{repo.owner.login}_{repo.name}_{name}"
+        self.name = name
+
+    def associatedPullRequests(self, first=None, last=None, **kwargs):
+        prs = [pr for pr in self.repo.prs if pr.headRefName == self.name]
+        return Connection(prs, first, None, last)
+
+
+class Repository(Node):
+    typename = 'Repository'
+
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+        self.id = f"R_{owner.login}_{name}"
+        self.issue_list = []
+        self.prs = []
+        self.branches = []
+        self.label_list = []
+        self.isArchived = False
+
+    def issues(self, first=None, after=None, labels=None, states=None,
+               filterBy=None, orderBy=None, **kwargs):
+        filterBy = filterBy or {}
+        issues = [i for i in self.issue_list
+                  if match_state(i, states) and match_labels(i, labels)
+                  and (not filterBy.get('createdBy') or
+                       i.author.login == filterBy['createdBy'])]
+        if orderBy:
+            field = {'CREATED_AT': 'createdAt', 'UPDATED_AT': 'updatedAt'}[orderBy['field']]
+            issues.sort(key=lambda i: getattr(i, field),
+                        reverse=orderBy.get('direction') == 'DESC')
+        return Connection(issues, first, after)
+
+    def pullRequests(self, first=None, after=None, labels=None, states=None,
+                     **kwargs):
+        prs = [pr for pr in self.prs
+               if match_state(pr, states) and match_labels(pr, labels)]
+        return Connection(prs, first, after)
+
+    def labels(self, first=None, after=None, query=None, **kwargs):
+        labels = self.label_list
+        if query:
+            words = query.lower().split()
+            labels = [l for l in labels if any(w in l.name.lower() for w in words)]
+        return Connection(labels, first, after)
+
+    def label(self, name):
+        for label in self.label_list:
+            if label.name.lower() == name.lower():
+                return label
+        return None
+
+    def refs(self, first=None, after=None, refPrefix='', **kwargs):
+        return Connection(self.branches, first, after)
+
+    def ref(self, qualifiedName):
+        name = qualifiedName[len('refs/heads/'):]
+        for ref in self.branches:
+            if ref.name == name:
+                return ref
+        return None
+
+    def issue(self, number):
+        return self.item(number, Issue)
+
+    def pullRequest(self, number):
+        return self.item(number, PullRequest)
+
+    def issueOrPullRequest(self, number):
+        return self.item(number, Item)
+
+    def item(self, number, cls):
+        for item in self.issue_list + self.prs:
+            if item.number == number and isinstance(item, cls):
+                return item
+        return None
+
+
+class World:
+    """Synthetic GitHub data."""
+
+    def __init__(self):
+        self.repos = {}
+        self.users = {}
+        self.viewer = None
+        self.nodes = {}
+
+    @classmethod
+    def generate(cls, repos=1, issues=500, prs=500, branches=200, labels=20,
+                 users=20, references=2, owner='bench', seed=1):
+        """Creates repos repositories named <owner>/repo<i> with the given
+        number of issues, PRs, branches and labels each. Every item is
+        cross referenced by up to references other items."""
+
+        rnd = random.Random(seed)
+        world = cls()
+        people = [world.user(f"user{i}") for i in range(users)]
+        world.viewer = people[0]
+        org = world.user(owner)
+
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        two_years = 2 * 365 * 24 * 3600
+
+        def dates():
+            created = now - datetime.timedelta(seconds=rnd.randrange(two_years))
+            age = int((now - created).total_seconds())
+            updated = created + datetime.timedelta(seconds=rnd.randrange(age + 1))
+            return created, updated
+
+        for r in range(repos):
+            repo = Repository(org, f"repo{r}")
+            world.repos[f"{owner}/repo{r}".lower()] = repo
+            repo.label_list = [Label(repo, f"label-{i}") for i in range(labels)]
+            repo.branches = [Ref(repo, f"branch-{i}") for i in range(branches)]
+
+            number = 0
+            for i in range(issues + prs):
+                number += 1
+                created, updated = dates()
+                item_labels = rnd.sample(repo.label_list, min(len(repo.label_list), 2))
+                author = rnd.choice(people)
+                if i < issues:
+                    state = rnd.choice(['OPEN', 'CLOSED'])
+                    item = Issue(repo, number, author, created, updated, state,
+                                 item_labels)
+                    repo.issue_list.append(item)
+                else:
+                    state = rnd.choice(['OPEN', 'CLOSED', 'MERGED', 'MERGED'])
+                    branch = None
+                    if repo.branches:
+                        branch = repo.branches[(i - issues) % len(repo.branches)].name
+                    item = PullRequest(repo, number, author, created, updated,
+                                       state, item_labels, branch=branch)
+                    repo.prs.append(item)
+                item.item_participants += rnd.sample(people, 2)
+
+            items = repo.issue_list + repo.prs
+            for item in items:
+                for _ in range(rnd.randrange(references + 1)):
+                    item.references.append(rnd.choice(items))
+
+            # newest first, like the GitHub defaults used by the commands
+            repo.issue_list.sort(key=lambda i: i.updatedAt, reverse=True)
+            repo.prs.sort(key=lambda i: i.updatedAt, reverse=True)
+
+        for repo in world.repos.values():
+            for obj in repo.issue_list + repo.prs + repo.branches + repo.label_list:
+                world.nodes[obj.id] = obj
+        return world
+
+    def user(self, login):
+        if login not in self.users:
+            self.users[login] = User(self, login)
+        return self.users[login]
+
+    def items(self):
+        for repo in self.repos.values():
+            yield from repo.issue_list
+            yield from repo.prs
+
+    def prs(self):
+        for repo in self.repos.values():
+            yield from repo.prs
+
+
+class Query:
+    """Root query type."""
+
+    typename = 'Query'
+    interfaces = ()
+
+    def __init__(self, world):
+        self.world = world
+        self.viewer = world.viewer
+
+    def user(self, login):
+        return self.world.users.get(login)
+
+    def repository(self, owner, name):
+        return self.world.repos.get(f"{owner}/{name}".lower())
+
+    def organization(self, login):
+        return self.world.users.get(login)
+
+    def node(self, id):
+        return self.world.nodes.get(id)
+
+    def rateLimit(self, **kwargs):
+        reset = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        return {'limit': 5000, 'cost': 1, 'remaining': 4999,
+                'resetAt': fmt_time(reset)}
+
+    def search(self, query, type=None, first=None, after=None, **kwargs):
+        items = search(self.world, query)
+        conn = Connection(items[:1000], first, after)
+        conn.issueCount = len(items)
+        return conn
+
+
+class Mutation:
+    """Root mutation type."""
+
+    typename = 'Mutation'
+    interfaces = ()
+
+    def __init__(self, world):
+        self.world = world
+
+    def addLabelsToLabelable(self, input):
+        item = self.world.nodes[input['labelableId']]
+        for id in input['labelIds']:
+            label = self.world.nodes[id]
+            if label not in item.item_labels:
+                item.item_labels.append(label)
+        return {'clientMutationId': input.get('clientMutationId')}
+
+    def removeLabelsFromLabelable(self, input):
+        item = self.world.nodes[input['labelableId']]
+        remove = set(input['labelIds'])
+        item.item_labels = [l for l in item.item_labels if l.id not in remove]
+        return {'clientMutationId': input.get('clientMutationId')}
+
+
+def match_state(item, states):
+    return not states or item.state in states
+
+
+def match_labels(item, labels):
+    if not labels:
+        return True
+    names = set(l.name for l in item.item_labels)
+    return any(l in names for l in labels)
+
+
+def search(world, query):
+    """Subset of the GitHub issue search syntax used by gh."""
+
+    filters = []
+    sort = ('updatedAt', True)
+    terms = []
+    for q in split_query(query):
+        key, _, value = q.partition(':')
+        if not value:
+            terms.append(q.lower())
+            continue
+        value = value.strip('"')
+        if key == 'type':
+            cls = PullRequest if value == 'pr' else Issue
+            filters.append(lambda i, cls=cls: isinstance(i, cls))
+        elif key == 'repo':
+            filters.append(lambda i, v=value.lower(): repo_name(i) == v)
+        elif key in ('user', 'org'):
+            filters.append(lambda i, v=value.lower():
+                           i.repository.owner.login.lower() == v)
+        elif key == 'author':
+            filters.append(lambda i, v=value: i.author.login == v)
+        elif key == 'involves':
+            filters.append(lambda i, v=value: any(
+                u.login == v for u in i.item_participants))
+        elif key == 'label':
+            filters.append(lambda i, v=value: match_labels(i, [v]))
+        elif key in ('is', 'state'):
+            filters.append(state_filter(value))
+        elif key in ('created', 'updated', 'closed', 'merged'):
+            filters.append(date_filter(key + 'At', value))
+        elif key == 'sort':
+            field, _, direction = value.partition('-')
+            sort = (field + 'At', direction != 'asc')
+        elif key == 'in':
+            pass
+
+    items = [i for i in world.items() if all(f(i) for f in filters)
+             and all(t in i.title.lower() for t in terms)]
+    field, reverse = sort
+    items.sort(key=lambda i: getattr(i, field, None) or '', reverse=reverse)
+    return items
+
+
+def split_query(query):
+    parts, current, quoted = [], '', False
+    for c in query:
+        if c == '"':
+            quoted = not quoted
+        if c == ' ' and not quoted:
+            if current:
+                parts.append(current)
+            current = ''
+        else:
+            current += c
+    if current:
+        parts.append(current)
+    return parts
+
+
+def repo_name(item):
+    return f"{item.repository.owner.login}/{item.repository.name}".lower()
+
+
+def state_filter(value):
+    states = {
+        'open': lambda i: i.state == 'OPEN',
+        'closed': lambda i: i.state != 'OPEN',
+        'merged': lambda i: i.state == 'MERGED',
+        'unmerged': lambda i: i.state != 'MERGED',
+    }
+    return states.get(value, lambda i: True)
+
+
+def date_filter(field, value):
+    lo, _, hi = value.partition('..')
+    lo = fmt_time(parse_time(lo)) if lo and lo != '*' else None
+    hi = fmt_time(parse_time(hi)) if hi and hi != '*' else None
+
+    def match(item):
+        d = getattr(item, field, None)
+        if d is None:
+            return False
+        return (lo is None or d >= lo) and (hi is None or d <= hi)
+    return match
+
+
+# query evaluation
+
+class Executor:
+    def __init__(self, document, variables):
+        from graphql.language.ast import FragmentDefinition, OperationDefinition
+
+        self.variables = variables or {}
+        self.fragments = {}
+        self.operation = None
+        for d in document.definitions:
+            if isinstance(d, FragmentDefinition):
+                self.fragments[d.name.value] = d
+            elif isinstance(d, OperationDefinition) and self.operation is None:
+                self.operation = d
+
+    def run(self, root):
+        return self.selections(root, self.operation.selection_set)
+
+    def selections(self, obj, selection_set):
+        from graphql.language.ast import Field, FragmentSpread, InlineFragment
+
+        out = {}
+        for sel in selection_set.selections:
+            if isinstance(sel, Field):
+                key = (sel.alias or sel.name).value
+                merge(out, key, self.field(obj, sel))
+            elif isinstance(sel, InlineFragment):
+                if applies(obj, sel.type_condition):
+                    merge_all(out, self.selections(obj, sel.selection_set))
+            elif isinstance(sel, FragmentSpread):
+                frag = self.fragments[sel.name.value]
+                if applies(obj, frag.type_condition):
+                    merge_all(out, self.selections(obj, frag.selection_set))
+        return out
+
+    def field(self, obj, field):
+        name = field.name.value
+        if name == '__typename':
+            return obj.typename
+        args = dict((a.name.value, self.value(a.value)) for a in field.arguments)
+        args = dict((k, v) for k, v in args.items() if v is not None)
+
+        if isinstance(obj, dict):
+            value = obj.get(name)
+        else:
+            value = getattr(obj, name, None)
+        if callable(value):
+            value = value(**args)
+        return self.complete(value, field.selection_set)
+
+    def complete(self, value, selection_set):
+        if value is None or selection_set is None:
+            return value
+        if isinstance(value, list):
+            return [self.complete(v, selection_set) for v in value]
+        return self.selections(value, selection_set)
+
+    def value(self, node):
+        kind = type(node).__name__
+        if kind == 'Variable':
+            return self.variables.get(node.name.value)
+        if kind == 'IntValue':
+            return int(node.value)
+        if kind == 'FloatValue':
+            return float(node.value)
+        if kind == 'BooleanValue':
+            return node.value
+        if kind == 'ListValue':
+            return [self.value(v) for v in node.values]
+        if kind == 'ObjectValue':
+            return dict((f.name.value, self.value(f.value)) for f in node.fields)
+        if kind == 'NullValue':
+            return None
+        return node.value
+
+
+def applies(obj, type_condition):
+    if type_condition is None or isinstance(obj, dict):
+        return True
+    name = type_condition.name.value
+    return name == obj.typename or name in obj.interfaces
+
+
+def merge(out, key, value):
+    if isinstance(out.get(key), dict) and isinstance(value, dict):
+        merge_all(out[key], value)
+    else:
+        out[key] = value
+
+
+def merge_all(out, values):
+    for k, v in values.items():
+        merge(out, k, v)
+
+
+# HTTP server
+
+class FakeGitHub:
+    """Serves World over HTTP on a local port.
+
+    latency (seconds) is added to every request. Requests and transferred
+    bytes are counted in stats.
+    """
+
+    def __init__(self, world, latency=0.0, host='127.0.0.1', port=0):
+        self.world = world
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self._documents = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, response = server.handle(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+                server.count(len(body), len(response))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/graphql"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes_received': 0, 'bytes_sent': 0}
+
+    def count(self, received, sent):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += received
+            self.stats['bytes_sent'] += sent
+
+    def handle(self, body):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            payload = json.loads(body)
+            document = self.parse(payload['query'])
+            executor = Executor(document, payload.get('variables'))
+            if executor.operation.operation == 'mutation':
+                with self.lock:
+                    data = executor.run(Mutation(self.world))
+            else:
+                data = executor.run(Query(self.world))
+            return 200, json.dumps({'data': data}).encode('utf-8')
+        except Exception as e:
+            return 200, json.dumps({'errors': [{'message': str(e)}]}).encode('utf-8')
+
+    def parse(self, query):
+        from graphql.language.parser import parse
+
+        with self.lock:
+            document = self._documents.get(query)
+        if document is None:
+            document = parse(query)
+            with self.lock:
+                self._documents[query] = document
+        return document
@@ -0,0 +1,63 @@
+"""Measure gh startup time.
+
+Runs a few invocations that do not talk to GitHub and reports the best and
+median wall time per command:
+
+    python bench/startup.py [-n RUNS]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+cases = [
+    ["--help"],
+    ["pr", "--help"],
+    ["branches", "prune_gone", "--help"],
+    ["branches", "prune_gone", "--dry", "--path", root],
+]
+
+
+def run(args, runs):
+    times = []
+    env = dict(os.environ, PYTHONPATH=root)
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "gh"] + args, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    opts = parser.parse_args()
+
+    # python interpreter startup as reference
+    base, _ = run_python(opts.runs)
+    print(f"{'python -c pass':<45} best {base * 1000:7.1f}ms")
+    for args in cases:
+        best, median = run(args, opts.runs)
+        name = "gh " + " ".join(args)
+        print(f"{name:<45} best {best * 1000:7.1f}ms  "
+              f"median {median * 1000:7.1f}ms")
+
+
+def run_python(runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"])
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+if __name__ == '__main__':
+    main()
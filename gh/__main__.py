@@ -1,26 +1,167 @@
 import argparse
+import importlib
 import os
+import sys
 
-from clidec import root, argument, with_commands
+from clidec import root, argument, with_commands, namespace
 
-from . import branches
-from . import issues
-from . import pr
-from . import user
+from . import cache
+from . import fmt
+from . import mirror
+from . import trace
 
 
 default_token_file = os.path.expanduser("~/.elastic/github.token")
 
 
-main = root(
-        argument("--token", default=default_token_file, help='token file'),
-        with_commands(
-            branches.ns,
-            issues.ns,
-            pr.ns,
-            user.ns,
-        ),
-)
+def default_socket():
+    base = os.environ.get('XDG_RUNTIME_DIR') or cache.default_path()
+    return os.path.join(base, 'gh.sock')
+
+
+root_arguments = [
+    argument("--token", default=default_token_file, help='token file'),
+    argument("--cache", default=False, action='store_true',
+             help='cache API responses on disk'),
+    argument("--cache-dir", default=cache.default_path(),
+             help='response cache directory'),
+    argument("--pool-size", default=10, type=int,
+             help='max number of pooled HTTP connections'),
+    argument("--timeout", default=30, type=float,
+             help='HTTP request timeout in seconds'),
+    argument("--stats", default=False, action='store_true',
+             help='print HTTP transport and rate limit statistics on exit'),
+    argument("--mirror", default=mirror.default_path(),
+             help='local database used by sync and --local'),
+    argument("--target-cost", default=5, type=int,
+             help='max GraphQL rate limit cost per request once the '
+                  'rate limit budget runs low'),
+    argument("--format", default='text', choices=fmt.formats,
+             help='output format for issues and pull requests'),
+    argument("--record", default=None,
+             help='append GraphQL requests and responses to this cassette'),
+    argument("--replay", default=None,
+             help='answer GraphQL requests from this cassette, offline'),
+    argument("--replay-latency", default='none',
+             help="replay delay: none, recorded or milliseconds"),
+    argument("--trace", default=None,
+             help='write a Chrome trace of the command to this file'),
+    argument("--profile", default=None,
+             help='write cProfile stats of the command to this file'),
+    argument("--daemon", default=default_socket(),
+             help='socket of the gh daemon, commands are forwarded while it runs'),
+]
+
+
+# command namespaces and the modules implementing them. Modules are only
+# imported if the namespace is selected on the command line.
+commands = {
+    'branches': 'branches',
+    'daemon': 'daemon',
+    'issue': 'issues',
+    'pr': 'pr',
+    'sync': 'sync',
+    'user': 'user',
+}
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    known = peek_args(args)
+    # the daemon module (and socket) is only loaded if a daemon may run
+    if known and forwardable(known) and os.path.exists(known.daemon):
+        from . import daemon
+        status = daemon.forward(known.daemon, args)
+        if status is not None:
+            sys.exit(status)
+    run(args, known)
+
+
+# Commands never forwarded to the daemon, by namespace (None for all
+# subcommands). The daemon runs one command at a time with its own
+# environment, so interactive commands (editor, browser), long running
+# commands and commands pushing with the users git credentials run in the
+# calling process.
+local_commands = {
+    'branches': None,
+    'daemon': None,
+    'sync': None,
+    'pr': {'create', 'open', 'watch'},
+}
+
+
+def forwardable(known):
+    """Commands run by the daemon. Options observing the process itself
+    and local_commands run in the calling process."""
+
+    if known.trace or known.profile or known.stats:
+        return False
+    if known.command is None:
+        return False
+    subcommands = local_commands.get(known.command, set())
+    if subcommands is None:
+        return False
+    return not known.rest or known.rest[0] not in subcommands
+
+
+def run(args, known=None):
+    if known is None:
+        known = peek_args(args)
+    if known and known.trace:
+        trace.start(known.trace)
+
+    try:
+        with trace.span('gh', cat='main', command=" ".join(args)):
+            namespaces = []
+            for name, module in commands.items():
+                if known and name == known.command:
+                    with trace.span(f"import {module}", cat='import'):
+                        ns = importlib.import_module(f".{module}", __package__).ns
+                else:
+                    # placeholder, so help and error messages list all commands
+                    ns = namespace(name)
+                namespaces.append(ns)
+
+            cli = root(*root_arguments, with_commands(*namespaces))
+            if known and known.profile:
+                profile(known.profile, cli.run, args=args)
+            else:
+                cli.run(args=args)
+    finally:
+        trace.stop()
+
+
+def profile(path, fn, *args, **kwargs):
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+
+
+class PeekParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+
+def peek_args(args):
+    """Parse the root arguments and selected command, before the command
+    modules are loaded. Returns None if args can not be parsed."""
+
+    parser = PeekParser(add_help=False)
+    for arg in root_arguments:
+        arg.init_args(parser)
+    parser.add_argument("command", nargs='?')
+    parser.add_argument("rest", nargs=argparse.REMAINDER)
+    try:
+        known, _ = parser.parse_known_args(args)
+    except ValueError:
+        return None
+    return known
 
 
 if __name__ == '__main__':
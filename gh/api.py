@@ -1,31 +1,125 @@
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import atexit
+import os
+import sys
+import threading
 
+from . import cache
 from . import gqlobj
+from . import metadata
+from . import trace
+from . import util
+from .cache import Cache
+from .ratelimit import Scheduler
 
 
-def connect(token_file):
+# GH_API_URL points gh at another endpoint, e.g. the benchmark server
+url = os.environ.get('GH_API_URL', 'https://api.github.com/graphql')
+
+
+def headers(token_file):
     with open(token_file) as f:
         token = f.read().strip()
 
+    return {
+        "Authorization": "bearer {}".format(token),
+        "Accept": ",".join([
+            "application/vnd.github.starfire-preview+json",
+            "application/vnd.github.shadow-cat-preview+json",
+        ]),
+    }
+
+
+def connect(token_file, pool_size=10, timeout=30, record=None, replay=None,
+            replay_latency=None):
+    """Create a GraphQL client.
+
+    If record is set, all requests and responses are appended to this
+    cassette file. If replay is set, responses are served from the
+    cassette, without network access or token.
+    """
+
+    from gql import Client
+    from .transport import HTTPTransport, CassetteTransport
+
+    if replay:
+        transport = CassetteTransport(replay, latency=replay_latency)
+    else:
+        transport = HTTPTransport(
+            url=url,
+            headers=headers(token_file),
+            timeout=timeout,
+            pool_size=pool_size,
+        )
+        if record:
+            transport = CassetteTransport(record, transport)
+
     return Client(
-        transport=RequestsHTTPTransport(
-            url='https://api.github.com/graphql',
-            use_json=True,
-            headers={
-                "Authorization": "bearer {}".format(token),
-                "Accept": ",".join([
-                    "application/vnd.github.starfire-preview+json",
-                    "application/vnd.github.shadow-cat-preview+json",
-                ]),
-            },
-        ),
+        transport=transport,
         # fetch_schema_from_transport=True,
     )
 
 
-def client(token_file):
-    return APIClient(connect(token_file))
+def client(token_file, cache=None, scheduler=None, metadata_path=None,
+           **kwargs):
+    return APIClient(connect(token_file, **kwargs), cache=cache,
+                     scheduler=scheduler, metadata_path=metadata_path)
+
+
+# clients shared by commands run in the same process, see from_args
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def from_args(args):
+    """Returns the client configured by the root arguments. Clients are
+    shared per process and configuration, so a resident process (gh daemon)
+    keeps connections, caches and rate limit state between commands.
+    Recording, replaying and --stats always create a new client."""
+
+    if args.record or args.replay or args.stats:
+        return new_client(args)
+
+    key = (args.token, args.cache, args.cache_dir, args.pool_size,
+           args.timeout, args.target_cost)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = new_client(args)
+        return client
+
+
+def new_client(args):
+    from .transport import replay_latency
+
+    cache = None
+    if args.cache:
+        cache = Cache(args.cache_dir, CACHE_TTL)
+    scheduler = Scheduler(target_cost=args.target_cost)
+    if args.stats:
+        register_stats(scheduler)
+
+    # cassettes must contain every lookup, so the persistent metadata store
+    # is not used while recording or replaying
+    metadata_path = None
+    if not (args.record or args.replay):
+        metadata_path = metadata.default_path(args.cache_dir)
+    return client(args.token, cache=cache, scheduler=scheduler,
+                  metadata_path=metadata_path,
+                  pool_size=args.pool_size, timeout=args.timeout,
+                  record=args.record, replay=args.replay,
+                  replay_latency=replay_latency(args.replay_latency))
+
+
+def register_stats(scheduler=None):
+    def show():
+        from . import transport
+        print(f"http: {transport.stats}", file=sys.stderr)
+        if scheduler:
+            print(f"rate limit: {scheduler}", file=sys.stderr)
+    atexit.register(show)
+
+
+compiled_dir = os.path.join(cache.default_path(), 'compiled')
 
 
 GHAPI = gqlobj.MakeClass('GHAPI', """
@@ -48,6 +142,12 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         }
     }
 
+    mutation remove_labels($input: RemoveLabelsFromLabelableInput!) {
+        removeLabelsFromLabelable(input:$input) {
+            clientMutationId
+        }
+    }
+
     query repo_id($user: String!, $name: String!) {
         repository(owner:$user, name:$name) {
             id
@@ -66,6 +166,15 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         }
     }
 
+    query repo_label($user: String!, $repo: String!, $label: String!) {
+        repository(owner:$user, name:$repo) {
+            label(name:$label) {
+                id
+                name
+            }
+        }
+    }
+
     query repo_label_ids(
           $count: Int!,
           $user: String!,
@@ -75,6 +184,7 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
     ) {
         repository(owner:$user, name:$repo) {
             labels(first:$count, after:$cursor, query:$query) {
+                pageInfo { hasNextPage endCursor }
                 edges {
                     cursor
                     node {
@@ -142,16 +252,23 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         $labels: [String!],
         $states: [IssueState!],
         $filter: IssueFilters,
+        $orderBy: IssueOrder,
         $cursor: String
     ) {
       repository(owner:$user, name:$name) {
-        issues(first:$count, after:$cursor, labels:$labels, states:$states, filterBy: $filter) {
+        issues(first:$count, after:$cursor, labels:$labels, states:$states,
+               filterBy: $filter, orderBy: $orderBy) {
+          pageInfo { hasNextPage endCursor }
           edges {
             cursor
             node {
               author {
                 login
               }
+              repository {
+                owner { login }
+                name
+              }
               createdAt
               updatedAt
               number
@@ -189,6 +306,7 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
     ) {
         repository(owner:$user, name:$repo) {
           refs(first:$count, after:$cursor, refPrefix:"refs/heads/") {
+              pageInfo { hasNextPage endCursor }
               edges {
                 cursor
                 node {
@@ -206,6 +324,25 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         }
     }
 
+    query ref_prs(
+          $user: String!,
+          $repo: String!,
+          $ref: String!
+    ) {
+        repository(owner:$user, name:$repo) {
+          ref(qualifiedName:$ref) {
+            id
+            name
+            associatedPullRequests(first:5) {
+                nodes {
+                    number
+                    state
+                }
+            }
+          }
+        }
+    }
+
     query user_prs(
         $count: Int!,
         $user: String!,
@@ -224,6 +361,8 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         $cursor:String
     ) {
         search(first:$count, after:$cursor, query:$query, type:ISSUE) {
+            issueCount
+            pageInfo { hasNextPage endCursor }
             edges {
                 cursor
                 node {
@@ -262,6 +401,8 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         $cursor:String
     ) {
         search(first:$count, after:$cursor, query:$query, type:ISSUE) {
+            issueCount
+            pageInfo { hasNextPage endCursor }
             edges {
                 cursor
                 node {
@@ -294,6 +435,126 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         }
     }
 
+    query org_repos(
+          $count: Int!,
+          $org: String!,
+          $cursor: String
+    ) {
+        organization(login:$org) {
+            repositories(first:$count, after:$cursor, isFork:false,
+                         orderBy:{field:NAME, direction:ASC}) {
+                pageInfo { hasNextPage endCursor }
+                edges {
+                    cursor
+                    node {
+                        name
+                        isArchived
+                    }
+                }
+            }
+        }
+    }
+
+    query repo_labels(
+          $count: Int!,
+          $user: String!,
+          $repo: String!,
+          $cursor: String
+    ) {
+        repository(owner:$user, name:$repo) {
+            labels(first:$count, after:$cursor) {
+                pageInfo { hasNextPage endCursor }
+                edges {
+                    cursor
+                    node {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    }
+
+    query sync_issues(
+        $count: Int!,
+        $user: String!,
+        $name: String!,
+        $cursor: String
+    ) {
+        repository(owner:$user, name:$name) {
+            issues(first:$count, after:$cursor,
+                   orderBy:{field:UPDATED_AT, direction:DESC}) {
+                pageInfo { hasNextPage endCursor }
+                edges {
+                    cursor
+                    node {
+                        ...issueCommon
+                        ...issueCrossReferences
+                        createdAt
+                        updatedAt
+                        closedAt
+                        repository {
+                            owner { login }
+                            name
+                        }
+                        assignees(first:20) {
+                            nodes { login }
+                        }
+                        participants(first:20) {
+                            nodes { login }
+                        }
+                        projectCards(first:20) {
+                            nodes {
+                                state
+                                project { name }
+                                column { name }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    query sync_prs(
+        $count: Int!,
+        $user: String!,
+        $name: String!,
+        $cursor: String
+    ) {
+        repository(owner:$user, name:$name) {
+            pullRequests(first:$count, after:$cursor,
+                         orderBy:{field:UPDATED_AT, direction:DESC}) {
+                pageInfo { hasNextPage endCursor }
+                edges {
+                    cursor
+                    node {
+                        ...prCommon
+                        ...prCrossReferences
+                        createdAt
+                        updatedAt
+                        closedAt
+                        mergedAt
+                        repository {
+                            owner { login }
+                            name
+                        }
+                        participants(first:20) {
+                            nodes { login }
+                        }
+                        projectCards(first:20) {
+                            nodes {
+                                state
+                                project { name }
+                                column { name }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
     query commit_prs($user: String!, $name: String!,$commitID: GitObjectID!) {
         repository(owner:$user, name:$name) {
             object(oid:$commitID) {
@@ -310,8 +571,74 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
         }
     }
 
+    query item_id($user: String!, $name: String!, $number: Int!) {
+        repository(owner:$user, name:$name) {
+            issueOrPullRequest(number:$number) {
+                ... on Issue { id }
+                ... on PullRequest { id }
+            }
+        }
+    }
+
+    query node_references($id: ID!, $count: Int!, $cursor: String) {
+        node(id:$id) {
+            __typename
+            ... on Issue {
+                ...graphIssue
+                timelineItems(itemTypes:[CROSS_REFERENCED_EVENT],
+                              first:$count, after:$cursor) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes {
+                        ... on CrossReferencedEvent {
+                            source {
+                                __typename
+                                ... on Issue { ...graphIssue }
+                                ... on PullRequest { ...graphPR }
+                            }
+                        }
+                    }
+                }
+            }
+            ... on PullRequest {
+                ...graphPR
+                timelineItems(itemTypes:[CROSS_REFERENCED_EVENT],
+                              first:$count, after:$cursor) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes {
+                        ... on CrossReferencedEvent {
+                            source {
+                                __typename
+                                ... on Issue { ...graphIssue }
+                                ... on PullRequest { ...graphPR }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    fragment graphIssue on Issue {
+        id
+        number
+        title
+        state
+        url
+        repository { owner { login } name }
+    }
+
+    fragment graphPR on PullRequest {
+        id
+        number
+        title
+        state
+        url
+        repository { owner { login } name }
+    }
+
     fragment collectPRs on User {
         pullRequests(first:$count,after:$cursor,labels:$labels,states:$states) {
+            pageInfo { hasNextPage endCursor }
             edges {
                 cursor
                 node {
@@ -414,26 +741,199 @@ GHAPI = gqlobj.MakeClass('GHAPI', """
             }
         }
     }
-""")
+""", cache_dir=compiled_dir)
+
+
+def pr_info_ttl(data):
+    pr = (data.get('repository') or {}).get('pullRequest') or {}
+    if pr.get('state') == 'MERGED':
+        return 7 * 24 * 3600
+    if pr.get('state') == 'CLOSED':
+        return 3600
+    return 60
+
+
+# cache TTLs in seconds per operation. Operations not listed are never cached.
+CACHE_TTL = {
+    'viewer_login': 24 * 3600,
+    'repo_id': 7 * 24 * 3600,
+    'repo_pr_id': 7 * 24 * 3600,
+    'repo_label_ids': 3600,
+    'repo_label': 3600,
+    'pr_info': pr_info_ttl,
+    'issue_info': 60,
+    'commit_prs': 3600,
+}
 
 
 class APIClient(GHAPI):
-    def __init__(self, *args, **kwargs):
-        super(APIClient, self).__init__(*args, **kwargs)
+    def __init__(self, client, cache=None, scheduler=None, metadata_path=None):
+        super(APIClient, self).__init__(client)
+        self._cache = cache
+        self._scheduler = scheduler
+        self.metadata = metadata.Metadata(metadata_path, self)
+
+    def execute_document(self, name, document, variables):
+        execute = super(APIClient, self).execute_document
+        if not self._scheduler:
+            return execute(name, document, variables)
+
+        return self._scheduler.execute(
+            self.operation_kind(name), name, document, variables,
+            lambda document, variables: execute(name, document, variables))
+
+    def execute_op(self, name, variables):
+        with trace.span(name, cat='graphql', kind=self.operation_kind(name),
+                        variables=variables):
+            return self._execute_op(name, variables)
+
+    def execute_batch(self, name, calls, size=None):
+        with trace.span(f"{name} (batch)", cat='graphql',
+                        kind=self.operation_kind(name), calls=len(calls)):
+            return self._execute_batch(name, calls, size)
+
+    def _execute_op(self, name, variables):
+        cache = self._cache
+        if not cache:
+            return super(APIClient, self).execute_op(name, variables)
+
+        if self.operation_kind(name) == 'mutation':
+            repos = cache.repos_of(variables)
+            try:
+                res = super(APIClient, self).execute_op(name, variables)
+            finally:
+                # Invalidate once the mutation is done. Queries running
+                # concurrently may have cached the old state until then.
+                # Also after errors, the mutation may have been applied.
+                cache.invalidate(repos)
+            try:
+                cache.index(repos, res)
+            except OSError:
+                pass
+            return res
+
+        hit, res = cache.get(name, variables)
+        trace.annotate(cached=hit)
+        if not hit:
+            res = super(APIClient, self).execute_op(name, variables)
+            cache.put(name, variables, res)
+        return res
+
+    def _execute_batch(self, name, calls, size=None):
+        cache = self._cache
+        if not cache:
+            return super(APIClient, self).execute_batch(name, calls, size)
+
+        if self.operation_kind(name) == 'mutation':
+            repos = set()
+            for variables in calls:
+                found = cache.repos_of(variables)
+                if found is None:
+                    repos = None
+                    break
+                repos.update(found)
+            try:
+                return super(APIClient, self).execute_batch(name, calls, size)
+            finally:
+                cache.invalidate(None if repos is None else sorted(repos))
+
+        results = [None] * len(calls)
+        missing = []
+        for i, variables in enumerate(calls):
+            hit, res = cache.get(name, variables)
+            if hit:
+                results[i] = res
+            else:
+                missing.append(i)
+        trace.annotate(cached=len(calls) - len(missing))
+
+        fetched = super(APIClient, self).execute_batch(
+            name, [calls[i] for i in missing], size)
+        for i, res in zip(missing, fetched):
+            cache.put(name, calls[i], res)
+            results[i] = res
+        return results
+
+
+def iter_gql(fn, key, *args, prefetch=1, **kwargs):
+    """Iterate all nodes of a paginated connection.
+
+    key is the path to the connections edges in the response. While the
+    caller consumes a page, up to `prefetch` further pages are fetched in
+    the background.
+    """
+
+    pages = iter_pages(fn, key, *args, **kwargs)
+    if not prefetch:
+        for page in pages:
+            for obj in page:
+                yield obj['node']
+        return
+
+    pages = util.prefetch(pages, prefetch)
+    try:
+        for page in pages:
+            for obj in page:
+                yield obj['node']
+    finally:
+        pages.close()
+
+
+def iter_gql_pool(pool, fn, key, *args, **kwargs):
+    """Like iter_gql, but pages are fetched by the executor pool.
+
+    The first page is requested immediately, so that the first pages of
+    many connections load concurrently. Afterwards the next page is
+    requested when the current page is handed to the caller.
+    """
+
+    first = pool.submit(fn, *args, **kwargs)
+    return pool_pages(pool, first, fn, key.split("."), args, kwargs)
+
+
+def pool_pages(pool, pending, fn, keys, args, kwargs):
+    try:
+        while pending:
+            edges, cursor = page_edges(pending.result(), keys)
+            pending = None
+            if not edges:
+                return
+            if cursor:
+                kwargs['cursor'] = cursor
+                pending = pool.submit(fn, *args, **kwargs)
+            for obj in edges:
+                yield obj['node']
+    finally:
+        if pending:
+            pending.cancel()
 
 
-def iter_gql(fn, key, *args, **kwargs):
+def iter_pages(fn, key, *args, **kwargs):
     keys = key.split(".")
     while True:
-        cur = fn(*args, **kwargs)
-        for key in keys:
-            if not key in cur:
-                return
-            cur = cur[key]
-
-        if not cur:
+        edges, cursor = page_edges(fn(*args, **kwargs), keys)
+        if not edges:
             return
-
-        for obj in cur:
-            kwargs['cursor'] = obj['cursor']
-            yield(obj['node'])
+        yield edges
+        if not cursor:
+            return
+        kwargs['cursor'] = cursor
+
+
+def page_edges(cur, keys):
+    """Returns the edges of a page and the cursor of the next page."""
+
+    for key in keys[:-1]:
+        if not cur or not key in cur:
+            return None, None
+        cur = cur[key]
+    if not cur or not cur.get(keys[-1]):
+        return None, None
+
+    edges = cur[keys[-1]]
+    page_info = cur.get('pageInfo')
+    if page_info is None:
+        return edges, edges[-1]['cursor']
+    if not page_info['hasNextPage']:
+        return edges, None
+    return edges, page_info['endCursor']
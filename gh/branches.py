@@ -4,7 +4,6 @@ import re
 from clidec import namespace, argument, command_name
 
 from . import project
-from . import api
 
 
 ns = namespace("branches")
@@ -20,34 +19,43 @@ def prune_gone(args):
     proj = project.open(args.path, remote=args.remote)
 
     # list of branches the remote tracking branch has been deleted for
-    branches = [h
-             for h in proj.repo.branches
-             if (h.tracking_branch() is not None and
-                 h.tracking_branch() not in proj.repo.references)]
-    worktrees = dict((wd.branch.name, wd) for wd in proj.worktrees())
-    for branch in branches:
-        if branch.name in worktrees:
-            wd = worktrees[branch.name]
-            print(f"remove worktree: {wd.path}")
-            if not args.dry:
-                try:
-                    wd.remove()
-                except Exception as e:
-                    print(f"failed to remove worktree: {e}")
-                    continue
-
-        print(f"delete gone branch: {branch.name}")
-        if not args.dry:
-            try:
-                branch.delete(proj.repo, branch.name, force=True)
-            except Exception as e:
-                print(f"failed to remove branch: {e}")
+    branches = proj.gone_branches()
+    worktrees = dict((ref[len('refs/heads/'):], wd)
+                     for wd, ref in proj.worktree_refs())
+
+    paths = [worktrees[name] for name in branches if name in worktrees]
+    for path in paths:
+        print(f"remove worktree: {path}")
+    if args.dry:
+        removed = {}
+    else:
+        removed = proj.remove_worktrees(paths)
+
+    delete = []
+    for name in branches:
+        err = removed.get(worktrees.get(name))
+        if err:
+            print(f"failed to remove worktree: {err}")
+            continue
+        delete.append(name)
+
+    results = {} if args.dry else proj.delete_branches(delete)
+    for name in delete:
+        err = results.get(name)
+        if err:
+            print(f"failed to remove branch {name}: {err}")
+        else:
+            print(f"delete gone branch: {name}")
 
 
 
 @ns.command(
         argument("--path", default=os.path.curdir, help='git directory'),
         argument("--dry", default=False, action='store_true', help="dry run"),
+        argument("--local-branches", default=False, action='store_true',
+                 help="only check local branches instead of all remote branches"),
+        argument("--branches", default="",
+                 help="comma separated list of branches to check"),
         argument("remote", default="origin", nargs='?',
                  help='git remote to delete from'),
 )
@@ -56,13 +64,25 @@ def prune_merged(args):
 
     branches = {}
 
-    client = api.client(args.token)
-    count = 50
+    # api is only loaded by commands talking to GitHub, keeping prune_gone
+    # and --help fast
+    from . import api
 
-    iter_branches = api.iter_gql(
-        client.query_iter_branch_prs, 'repository.refs.edges',
-        count, proj.user, proj.name)
+    client = api.from_args(args)
+    count = 50
 
+    if args.branches or args.local_branches:
+        if args.branches:
+            names = args.branches.split(',')
+        else:
+            names = sorted(proj.branch_names())
+        iter_branches = lookup_branches(client, proj, names)
+    else:
+        iter_branches = api.iter_gql(
+            client.query_iter_branch_prs, 'repository.refs.edges',
+            count, proj.user, proj.name)
+
+    local_branches = proj.branch_names()
     for branch in iter_branches:
         prs = []
         if branch['associatedPullRequests'] is not None:
@@ -76,9 +96,10 @@ def prune_merged(args):
             }
         }
 
-        if name in proj.repo.branches:
-            branches[name]['local'] = proj.repo.branches[name]
+        if name in local_branches:
+            branches[name]['local'] = True
 
+    delete_local, delete_remote = [], []
     for name, info in branches.items():
         numPRs = len(info['github']['prs'])
         if numPRs == 0:
@@ -92,17 +113,56 @@ def prune_merged(args):
                 print('    {}: {}'.format(pr['number'], pr['state']))
             continue
 
-        if proj.active_branch.name == name:
+        if proj.active_branch_name == name:
             print('Skip current branch "{}". Branch is already merged'.format(
                 name
             ))
             continue
 
         if 'local' in info:
-            print('delete local branch: {}'.format(name))
-            if not args.dry:
-                proj.repo.delete_head(name, force=True)
-
-        print('delete remote branch: {}'.format(name))
-        if not args.dry:
-            proj.remote.push(refspec=":{}".format(name))
+            delete_local.append(name)
+        delete_remote.append(name)
+
+    # run deletions in bulk, instead of one git process per branch. Remote
+    # branches are kept if deleting the local branch failed.
+    failed = report_deletions('local', delete_local,
+                              {} if args.dry else proj.delete_branches(delete_local))
+    for name in delete_remote:
+        if name in failed:
+            print('skip remote branch {}: local branch not deleted'.format(name))
+    delete_remote = [name for name in delete_remote if name not in failed]
+    report_deletions('remote', delete_remote,
+                     {} if args.dry else proj.delete_remote_branches(delete_remote))
+
+
+def report_deletions(kind, names, results):
+    """Print the outcome per branch. Returns the names that failed."""
+
+    failed = set()
+    for name in names:
+        err = results.get(name)
+        if err:
+            failed.add(name)
+            print('failed to delete {} branch {}: {}'.format(kind, name, err))
+        else:
+            print('delete {} branch: {}'.format(kind, name))
+    return failed
+
+
+def lookup_branches(client, proj, names, size=100):
+    """Resolve the remote refs and PRs of the given branches.
+
+    Refs are looked up in batches of aliased ref(qualifiedName:) queries,
+    so the cost depends on the number of branches requested, not on the
+    number of branches in the repository.
+    """
+
+    results = client.batch_ref_prs(
+        [(proj.user, proj.name, f"refs/heads/{name}") for name in names],
+        size=size)
+    for name, res in zip(names, results):
+        ref = res['repository']['ref']
+        if ref is None:
+            print('No remote branch: {}'.format(name))
+            continue
+        yield ref
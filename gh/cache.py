@@ -0,0 +1,247 @@
+import json
+import os
+import time
+
+
+def default_path():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'gh')
+
+
+class Cache:
+    """On-disk response cache.
+
+    Entries are stored as one JSON file per operation and normalized
+    variables, grouped by the repository the variables point to. Files are
+    written atomically via rename, so parallel gh processes can share a
+    cache directory without locking. Once more than `max_entries` files
+    (or `max_ids` node id index files) exist, the least recently used ones
+    are removed. Eviction scans the cache directory, so it only runs on the
+    first put of a process and every `evict_every` puts afterwards.
+    """
+
+    def __init__(self, path, ttls, max_entries=4096, max_ids=65536,
+                 evict_every=256):
+        self.path = path
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.evict_every = evict_every
+        self._puts = 0
+
+        self._entries = os.path.join(path, 'entries')
+        self._ids = os.path.join(path, 'ids')
+
+    def get(self, op, variables):
+        if op not in self.ttls:
+            return False, None
+
+        file = self._entry_file(op, variables)
+        entry = read_json(file)
+        if entry is None:
+            return False, None
+        if entry['expires'] < time.time():
+            remove(file)
+            return False, None
+
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return True, entry['data']
+
+    def put(self, op, variables, data):
+        ttl = self.ttls.get(op)
+        if callable(ttl):
+            ttl = ttl(data)
+        if not ttl:
+            return
+
+        entry = {
+            'op': op,
+            'expires': time.time() + ttl,
+            'data': data,
+        }
+        try:
+            write_json(self._entry_file(op, variables), entry)
+            repo = repo_of(variables)
+            if repo:
+                self.index([repo], data)
+        except OSError:
+            return
+
+        self._puts += 1
+        if (self._puts - 1) % self.evict_every == 0:
+            self.evict()
+
+    def repos_of(self, variables):
+        """Find the repositories a mutation touches.
+
+        Repositories are resolved from owner/name variables or from node ids
+        seen in earlier responses. Returns None if no repository is known.
+        """
+
+        repo = repo_of(variables)
+        if repo:
+            return [repo]
+
+        repos = set()
+        for value in iter_strings(variables):
+            repo = read_text(self._id_file(value))
+            if repo:
+                repos.add(repo)
+        return sorted(repos) or None
+
+    def index(self, repos, data):
+        if not repos:
+            return
+        for id in iter_ids(data):
+            for repo in repos:
+                write_text(self._id_file(id), repo)
+
+    def invalidate(self, repos=None):
+        if repos is None:
+            dirs = list_dir(self._entries)
+        else:
+            dirs = [repo_tag(r) for r in repos]
+
+        for d in dirs:
+            d = os.path.join(self._entries, d)
+            for name in list_dir(d):
+                remove(os.path.join(d, name))
+
+    def evict(self):
+        entries = [os.path.join(self._entries, d) for d in list_dir(self._entries)]
+        evict_lru(entries, self.max_entries)
+        evict_lru([self._ids], self.max_ids)
+
+    def _entry_file(self, op, variables):
+        key = hash_key(json.dumps([op, normalize(variables)], sort_keys=True))
+        tag = repo_tag(repo_of(variables))
+        return os.path.join(self._entries, tag, f"{op}-{key}.json")
+
+    def _id_file(self, id):
+        return os.path.join(self._ids, hash_key(id))
+
+
+def evict_lru(dirs, max_files):
+    """Remove the least recently used files in dirs beyond max_files."""
+
+    files = []
+    for d in dirs:
+        for name in list_dir(d):
+            file = os.path.join(d, name)
+            try:
+                files.append((os.stat(file).st_mtime, file))
+            except OSError:
+                continue
+
+    if len(files) <= max_files:
+        return
+    files.sort()
+    for _, file in files[:len(files) - max_files]:
+        remove(file)
+
+
+def normalize(variables):
+    out = {}
+    for k, v in variables.items():
+        if v is None:
+            continue
+        if k in ('user', 'name', 'repo') and isinstance(v, str):
+            v = v.lower()
+        out[k] = v
+    return out
+
+
+def repo_of(variables):
+    user = variables.get('user')
+    name = variables.get('name') or variables.get('repo')
+    if isinstance(user, str) and isinstance(name, str):
+        return f"{user}/{name}".lower()
+    return None
+
+
+def repo_tag(repo):
+    if not repo:
+        return '_'
+    return repo.replace('/', '@')
+
+
+def hash_key(s):
+    import hashlib
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def iter_strings(obj):
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from iter_strings(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from iter_strings(v)
+
+
+def iter_ids(obj):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == 'id' and isinstance(v, str):
+                yield v
+            else:
+                yield from iter_ids(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from iter_ids(v)
+
+
+def list_dir(path):
+    try:
+        return [n for n in os.listdir(path) if not n.startswith('.')]
+    except OSError:
+        return []
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_text(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_json(path):
+    txt = read_text(path)
+    if txt is None:
+        return None
+    try:
+        return json.loads(txt)
+    except ValueError:
+        return None
+
+
+def write_json(path, obj):
+    write_text(path, json.dumps(obj))
+
+
+def write_text(path, txt):
+    import tempfile
+
+    dir = os.path.dirname(path)
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(txt)
+        os.replace(tmp, path)
+    except BaseException:
+        remove(tmp)
+        raise
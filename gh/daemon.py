@@ -0,0 +1,357 @@
+"""Resident gh process serving commands over a Unix socket.
+
+`gh daemon start` keeps the command modules, compiled GraphQL operations,
+API clients with their pooled connections and caches, and opened projects
+in memory. While it runs, gh forwards its arguments, working directory and
+stdin/stdout/stderr file descriptors to the daemon, which runs the command
+on the caller's terminal and replies with the exit status. Commands are
+run one at a time. Ctrl-C in the caller cancels its own command in the
+daemon, also while it still waits for its turn. If no daemon is listening
+gh runs the command itself. Interactive and long running commands are
+never forwarded (see __main__.local_commands).
+
+The daemon uses its own environment. Restart it after changing GH_API_URL
+or XDG_* variables.
+"""
+
+import importlib
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from clidec import namespace, argument
+
+
+ns = namespace("daemon")
+
+
+@ns.command(
+    argument("--no-preload", default=False, action='store_true',
+             help="import command modules on first use"),
+)
+def start(args):
+    """Serve gh commands on the --daemon socket until stopped."""
+
+    from .__main__ import commands, run
+
+    if not args.no_preload:
+        for module in commands.values():
+            importlib.import_module(f".{module}", __package__)
+    serve(args.daemon, run)
+
+
+@ns.command()
+def stop(args):
+    """Stop the daemon listening on the --daemon socket."""
+
+    if request(args.daemon, {'stop': True}) is None:
+        print("daemon not running")
+
+
+@ns.command()
+def status(args):
+    """Print the pid of the daemon and number of commands served."""
+
+    resp = request(args.daemon, {'status': True})
+    if resp is None:
+        print("daemon not running")
+        exit(1)
+    print(f"pid {resp['pid']}, {resp['served']} commands served")
+
+
+def serve(path, run):
+    """Accept commands on path, running them with run(argv)."""
+
+    listener = listen(path)
+    signal.signal(signal.SIGUSR1, cancel_running)
+    signal.signal(signal.SIGTERM, terminate)
+    # keep SIGINT ignored when started in the background
+    if signal.getsignal(signal.SIGINT) is not signal.SIG_IGN:
+        signal.signal(signal.SIGINT, terminate)
+    print(f"gh daemon listening on {path}", file=sys.stderr, flush=True)
+    served = 0
+    try:
+        while True:
+            conn, _ = listener.accept()
+            with conn:
+                if not same_user(conn):
+                    continue
+                try:
+                    msg, fds, pending = receive(conn)
+                except (OSError, ValueError):
+                    continue
+
+                if msg.get('stop'):
+                    reply(conn, {'stopped': True})
+                    return
+                if msg.get('status'):
+                    reply(conn, {'pid': os.getpid(), 'served': served})
+                    continue
+                if len(fds) != 3:
+                    close_all(fds)
+                    continue
+                if pending:
+                    # cancelled while waiting for the previous command
+                    close_all(fds)
+                    reply(conn, {'status': 130})
+                    continue
+
+                served += 1
+                job = Job()
+                watcher = threading.Thread(target=watch, args=(conn, job),
+                                           daemon=True)
+                watcher.start()
+                status = execute(run, msg['argv'], msg['cwd'], fds, job)
+                reply(conn, {'status': status})
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                watcher.join()
+    except Terminated:
+        pass
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class Terminated(BaseException):
+    """Raised by SIGTERM or SIGINT sent to the daemon itself."""
+
+
+def terminate(signum, frame):
+    raise Terminated()
+
+
+class Job:
+    """A forwarded command. It is cancelled by the client sending a cancel
+    request or hanging up on its connection."""
+
+    def __init__(self):
+        self.cancelled = False
+
+
+# job currently executing in the main thread
+running = None
+
+
+def watch(conn, job):
+    """Waits for the client of job to cancel it, interrupting the job if it
+    is still executing."""
+
+    try:
+        conn.recv(4096)
+    except OSError:
+        pass
+    job.cancelled = True
+    if running is job:
+        os.kill(os.getpid(), signal.SIGUSR1)
+
+
+def cancel_running(signum, frame):
+    # The signal may be delivered late, after the job finished or while
+    # the next one runs. Only interrupt the job that was cancelled.
+    job = running
+    if job is not None and job.cancelled:
+        raise KeyboardInterrupt()
+
+
+def listen(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if request(path, {'status': True}) is not None:
+        raise Exception(f"daemon already listening on {path}")
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the daemon acts with the users token, only the user may connect
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen(16)
+    return sock
+
+
+def execute(run, argv, cwd, fds, job):
+    """Runs argv with the callers stdin, stdout and stderr in cwd.
+    Returns the exit status."""
+
+    global running
+    from . import project
+
+    home = os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(fd) for fd in range(3)]
+    try:
+        for fd, client_fd in enumerate(fds):
+            os.dup2(client_fd, fd)
+        os.chdir(cwd)
+        try:
+            running = job
+            if job.cancelled:
+                raise KeyboardInterrupt()
+            project.refresh()
+            run(argv)
+        finally:
+            # no cancel can interrupt restoring the daemons fds below
+            running = None
+        status = 0
+    except SystemExit as e:
+        status = exit_status(e.code)
+    except KeyboardInterrupt:
+        # cancelled by the caller, see forward
+        status = 130
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        for fd, saved_fd in enumerate(saved):
+            os.dup2(saved_fd, fd)
+        close_all(saved + list(fds))
+        os.chdir(home)
+    return status
+
+
+def exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def forward(path, argv):
+    """Runs argv in the daemon listening on path.
+
+    Returns the exit status, or None if no daemon is running.
+    """
+
+    conn = connect(path)
+    if conn is None:
+        return None
+    with conn:
+        msg = {'argv': argv, 'cwd': os.getcwd()}
+        try:
+            socket.send_fds(conn, [encode(msg)], [0, 1, 2])
+        except OSError:
+            return None
+
+        try:
+            try:
+                resp = read_message(conn)
+            except KeyboardInterrupt:
+                # cancel the command in the daemon and wait for it to stop
+                conn.sendall(encode({'cancel': True}))
+                resp = read_message(conn)
+        except KeyboardInterrupt:
+            return 130
+        except (OSError, ValueError):
+            resp = None
+        if resp is None:
+            print("gh: lost connection to daemon", file=sys.stderr)
+            return 1
+        return resp['status']
+
+
+def request(path, msg):
+    conn = connect(path)
+    if conn is None:
+        return None
+    with conn:
+        try:
+            conn.sendall(encode(msg))
+            return read_message(conn)
+        except (OSError, ValueError):
+            return None
+
+
+def connect(path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+
+def same_user(conn):
+    cred = peer_cred(conn)
+    if cred is None:
+        # rely on the socket file permissions
+        return True
+    return cred[1] == os.getuid()
+
+
+def peer_cred(conn):
+    """Returns (pid, uid, gid) of the peer, or None if not supported."""
+
+    opt = getattr(socket, 'SO_PEERCRED', None)
+    if opt is None:
+        return None
+    return struct.unpack('3i', conn.getsockopt(
+        socket.SOL_SOCKET, opt, struct.calcsize('3i')))
+
+
+def receive(conn):
+    """Reads one message and the file descriptors sent along with it.
+    Also returns any data the client sent after the message."""
+
+    data, fds, _flags, _addr = socket.recv_fds(conn, 65536, 3)
+    while b"\n" not in data:
+        chunk = conn.recv(65536)
+        if not chunk:
+            close_all(fds)
+            raise ValueError("incomplete message")
+        data += chunk
+    msg, _, pending = data.partition(b"\n")
+    return json.loads(msg), fds, pending
+
+
+def read_message(conn):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+    return json.loads(data)
+
+
+def reply(conn, msg):
+    try:
+        conn.sendall(encode(msg))
+    except OSError:
+        # client is gone
+        pass
+
+
+def encode(msg):
+    return json.dumps(msg).encode() + b"\n"
+
+
+def close_all(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
@@ -1,72 +1,240 @@
-
+import abc
+import json
+import sys
 import textwrap
 
-def issue_info(issue):
-    owner = issue['repository']['owner']['login']
+from . import trace
+
+
+formats = ('text', 'json', 'ndjson', 'tsv')
+
+
+def renderer(format='text', sep="\n", stream=None):
+    """Create a renderer for one of `formats` writing to stream.
+
+    sep is written after each record in text mode.
+    """
+
+    out = Writer(stream)
+    if format == 'json':
+        return JSONRenderer(out)
+    if format == 'ndjson':
+        return NDJSONRenderer(out)
+    if format == 'tsv':
+        return TSVRenderer(out)
+    return TextRenderer(out, sep)
+
+
+class Writer:
+    """File like object buffering writes and flushing them in blocks.
+
+    On a terminal, output is flushed after each record instead, so it
+    shows up as soon as it is available.
+    """
+
+    def __init__(self, stream=None, block_size=64 * 1024):
+        self.stream = stream
+        self.block_size = block_size
+        self._parts = []
+        self._size = 0
+        self._interactive = None
+
+    def end_record(self):
+        if self._interactive is None:
+            stream = self.stream or sys.stdout
+            try:
+                self._interactive = stream.isatty()
+            except (AttributeError, ValueError):
+                self._interactive = False
+        if self._interactive:
+            self.flush()
+
+    def write(self, s):
+        self._parts.append(s)
+        self._size += len(s)
+        if self._size >= self.block_size:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        with trace.span('flush', cat='fmt', bytes=self._size):
+            if self._parts:
+                stream.write("".join(self._parts))
+                self._parts = []
+                self._size = 0
+            stream.flush()
+
+
+class Renderer(abc.ABC):
+    """Streams issues and pull requests to a Writer.
+
+    Records are written as they are passed in, so memory usage does not
+    depend on the number of records. Use as context manager, or call close,
+    to write the trailer and flush the output.
+    """
+
+    def __init__(self, out):
+        self.out = out
+
+    def issue(self, issue):
+        with trace.span('render issue', cat='fmt'):
+            self.record('issue', issue)
+        self.out.end_record()
+
+    def pr(self, pr):
+        with trace.span('render pr', cat='fmt'):
+            self.record('pr', pr)
+        self.out.end_record()
+
+    @abc.abstractmethod
+    def record(self, kind, entry):
+        """Write entry of kind 'issue' or 'pr'."""
+
+    def close(self):
+        self.out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TextRenderer(Renderer):
+    def __init__(self, out, sep="\n"):
+        super(TextRenderer, self).__init__(out)
+        self.sep = sep
+
+    def record(self, kind, entry):
+        try:
+            if kind == 'pr':
+                pr_info(entry, self.out)
+            else:
+                issue_info(entry, self.out)
+        finally:
+            self.out.write(self.sep)
+
+
+class NDJSONRenderer(Renderer):
+    def record(self, kind, entry):
+        self.out.write(json.dumps(entry))
+        self.out.write("\n")
+
+
+class JSONRenderer(Renderer):
+    def __init__(self, out):
+        super(JSONRenderer, self).__init__(out)
+        self.count = 0
+
+    def record(self, kind, entry):
+        self.out.write("[\n" if self.count == 0 else ",\n")
+        self.out.write(json.dumps(entry))
+        self.count += 1
+
+    def close(self):
+        self.out.write("[]\n" if self.count == 0 else "\n]\n")
+        super(JSONRenderer, self).close()
+
+
+class TSVRenderer(Renderer):
+    columns = ('kind', 'repo', 'number', 'state', 'author', 'updated',
+               'title', 'url')
+
+    def __init__(self, out):
+        super(TSVRenderer, self).__init__(out)
+        self.out.write("\t".join(self.columns) + "\n")
+
+    def record(self, kind, entry):
+        repo = ""
+        if entry.get('repository'):
+            r = entry['repository']
+            repo = f"{r['owner']['login']}/{r['name']}"
+
+        url = entry.get('permalink') or ""
+        if not url and repo:
+            url = f"https://github.com/{repo}/issues/{entry['number']}"
+
+        author = entry.get('author') or {}
+        row = (kind, repo, entry.get('number'), entry.get('state'),
+               author.get('login'), entry.get('updatedAt'),
+               entry.get('title'), url)
+        self.out.write("\t".join(tsv_field(v) for v in row) + "\n")
+
+
+def tsv_field(v):
+    if v is None:
+        return ""
+    return " ".join(str(v).split("\t")).replace("\n", " ")
+
 
+def issue_info(issue, out=None):
     title = issue['title']
     if 'repository' in issue:
+        owner = issue['repository']['owner']['login']
         repo = f"{owner}/{issue['repository']['name']}"
         link = f"https://github.com/{repo}/issues/{issue['number']}"
         title = f"{repo} - {title}"
     else:
         repo, link = None, None
 
-    print(title)
-    print('-' * len(title))
-    print(issue['updatedAt'])
+    print(title, file=out)
+    print('-' * len(title), file=out)
+    if 'updatedAt' in issue:
+        print(issue['updatedAt'], file=out)
 
     info = f"{issue['state']} #{issue['number']}"
     if issue['author'] and 'login' in issue['author']:
         info += f" - {issue['author']['login']}"
-    print(info)
+    print(info, file=out)
 
-    print_labels(issue)
+    print_labels(issue, out)
     if link:
-        print(link)
-    print_participants(issue)
-    print_project_cards(issue)
+        print(link, file=out)
+    print_participants(issue, out)
+    print_project_cards(issue, out)
 
     if 'bodyText' in issue:
-        print()
-        print(bodyText)
-        print()
+        print(file=out)
+        print(issue['bodyText'], file=out)
+        print(file=out)
 
-    print_references(issue)
+    print_references(issue, out)
 
-def pr_info(pr):
+def pr_info(pr, out=None):
     title = pr['title']
     if 'repository' in pr:
         repo = f"{pr['repository']['owner']['login']}/{pr['repository']['name']}"
         title = f"{repo} - {title}"
 
-    print(title)
-    print('-' * len(title))
+    print(title, file=out)
+    print('-' * len(title), file=out)
     print(
-        f"{pr['state']} {pr['number']} - {pr['mergeable']} - {pr['author']['login']}")
+        f"{pr['state']} {pr['number']} - {pr['mergeable']} - {pr['author']['login']}",
+        file=out)
     if pr['state'] == 'MERGED' and 'mergeCommit' in pr:
         commit = pr['mergeCommit']
-        print(f"  {commit['committedDate']} - {commit['oid']}")
+        print(f"  {commit['committedDate']} - {commit['oid']}", file=out)
 
 
     if 'headRefName' in pr:
-        print(f"{pr['headRefName']}")
+        print(f"{pr['headRefName']}", file=out)
     if 'permalink' in pr:
-        print(f"{pr['permalink']}\n")
+        print(f"{pr['permalink']}\n", file=out)
 
-    print_labels(pr)
-    print_participants(pr)
-    print_project_cards(pr)
+    print_labels(pr, out)
+    print_participants(pr, out)
+    print_project_cards(pr, out)
 
     if 'bodyText' in pr:
-        print("\n".join(textwrap.wrap(pr['bodyText'], width=80)))
+        print("\n".join(textwrap.wrap(pr['bodyText'], width=80)), file=out)
 
     if 'commits' in pr:
         status = pr['commits']['nodes'][-1]['commit']['status']
         if status:
-            print("\n  status:")
-            print("  -------")
-            print("  " + status['state'])
+            print("\n  status:", file=out)
+            print("  -------", file=out)
+            print("  " + status['state'], file=out)
             if status['state'] != "SUCCESS":
                 for ctx in status['contexts']:
                     if ctx['state'] != 'SUCCESS':
@@ -74,47 +242,48 @@ def pr_info(pr):
                         context_msg = f"{ctx['context']}: {ctx['state']}"
                         if url is not None:
                             context_msg += f"\n\t{url}\n"
-                        print("  " + context_msg)
+                        print("  " + context_msg, file=out)
 
 
     if 'reviews' in pr:
         reviews = pr['reviews']['nodes']
         if len(reviews) > 0:
-            print("\n  reviews:")
-            print("  --------")
+            print("\n  reviews:", file=out)
+            print("  --------", file=out)
             for review in reviews:
                 print(
-                    f"  {review['createdAt']} {review['author']['login']} - {review['state']}")
+                    f"  {review['createdAt']} {review['author']['login']} - {review['state']}",
+                    file=out)
 
-    print_references(pr)
+    print_references(pr, out)
 
 
-def print_labels(entry):
+def print_labels(entry, out=None):
     if entry['labels'] and entry['labels']['nodes']:
-        print("labels: " + " ".join("'{}'".format(n['name']) for n in entry['labels']['nodes']))
+        print("labels: " + " ".join("'{}'".format(n['name']) for n in entry['labels']['nodes']), file=out)
 
 
-def print_participants(entry):
+def print_participants(entry, out=None):
     if 'participants' in entry and entry['participants'] and entry['participants']['nodes']:
-        print("participants: " + " ".join("'{}'".format(n['login']) for n in entry['participants']['nodes']))
+        print("participants: " + " ".join("'{}'".format(n['login']) for n in entry['participants']['nodes']), file=out)
 
-def print_project_cards(entry):
+def print_project_cards(entry, out=None):
     if 'projectCards' in entry and entry['projectCards'] and entry['projectCards']['nodes']:
-        print("projects:")
+        print("projects:", file=out)
         for card in entry['projectCards']['nodes']:
             info = card['project']['name']
             if 'column' in card and card['column'] and 'name' in card['column']:
                 info += f" - {card['column']['name']}"
             if 'state' in card:
                 info += f": {card['state']}"
-            print(info)
+            print(info, file=out)
 
-def print_references(entry):
+def print_references(entry, out=None):
     if 'timelineItems' in entry:
         references = entry['timelineItems']['nodes']
         if len(references) > 0:
-            print("\n  references:")
-            print("  -----------")
+            print("\n  references:", file=out)
+            print("  -----------", file=out)
             for node in references:
                 info = node['source']
                 kind = info['__typename']
@@ -130,15 +299,18 @@ def print_references(entry):
                 if 'author' in info and info['author'] and 'login' in info['author']:
                     login = info['author']['login']
                 print(
-                    f"  {kind} {info['state']} {info['number']}\t{login}\t{info['title']}")
+                    f"  {kind} {info['state']} {info['number']}\t{login}\t{info['title']}",
+                    file=out)
                 if info['state'] == 'MERGED':
                     commit = info['mergeCommit']
-                    print(f"    {commit['committedDate']} - {commit['oid']}")
+                    print(f"    {commit['committedDate']} - {commit['oid']}", file=out)
                 if info['labels']['nodes']:
                     print("  " + " ".join("'{}'".format(n['name'])
-                                   for n in info['labels']['nodes']))
-                print(f"  {link}")
+                                          for n in info['labels']['nodes']),
+                          file=out)
+                print(f"  {link}", file=out)
                 for review in reviews:
                     print(
-                        f"  {review['createdAt']} {review['author']['login']} - {review['state']}")
-                print()
+                        f"  {review['createdAt']} {review['author']['login']} - {review['state']}",
+                        file=out)
+                print(file=out)
@@ -1,37 +1,22 @@
+import copy
+import hashlib
+import json
+import os
 
-from graphql.language.parser import parse
-from graphql.language.printer import print_ast
-from graphql.language.ast import (
-    OperationDefinition,
-    FragmentDefinition,
-    FragmentSpread,
-)
 
-from gql import gql
+# bump when the format of compiled scripts changes
+compiled_version = 1
 
+def MakeClass(typeName, script, cache_dir=None):
+    """Create API class with one method per operation in script.
 
-def MakeClass(typeName, script):
-    doc = parse(script)
+    Operations are compiled lazily on first use. The script analysis
+    (fragment dependencies, variables, printed documents) is stored in
+    cache_dir and only recomputed if the script changes.
+    """
 
-    operations = {}
-    fragments = {}
-
-    dependencies = {}
-    scripts = {}
+    ops = Operations(load_compiled(script, cache_dir))
 
-    for definition in doc.definitions:
-        if isinstance(definition, OperationDefinition):
-            operations[definition.name.value] = definition
-        elif isinstance(definition, FragmentDefinition):
-            fragments[definition.name.value] = definition
-        else:
-            # ignore node type
-            continue
-
-        deps = [n.name.value for n in iter_fragment_spreads(definition)]
-        dependencies[definition.name.value] = deps
-
-    @classmethod
     def constructor(self, client):
         self._client = client
 
@@ -39,46 +24,309 @@ def MakeClass(typeName, script):
         "__init__": constructor,
     }
 
-    scripts = {}
     preps = {}
-
-    for name, op in operations.items():
-        deps = transitive_deps(dependencies, name)
-        txt = print_ast(op) + "\n" + "\n".join(
-            print_ast(fragments[dep]) for dep in deps
-        )
-
-        variables = [v.variable.name.value for v in op.variable_definitions]
-        prep = make_prepare_params(variables)
+    for name, op in ops.meta.items():
+        prep = make_prepare_params(op['variables'])
         preps[name] = prep
 
-        code = gql(txt)
-        scripts[name] = code
-
-        opname = op.operation
+        opname = op['kind']
         if opname == "mutation":
             opname = "mut"
 
-        namespace[f"{opname}_{name}"] = make_exec(prep, code)
+        namespace[f"{opname}_{name}"] = make_exec(name, prep)
+
+        if op['batchable']:
+            namespace[f"batch_{name}"] = make_batch_exec(name, prep)
 
     @classmethod
     def get_script(cls, name):
-        return scripts[name]
+        return ops.document(name)
 
     @classmethod
     def params(cls, name, *args, **kwargs):
         return preps[name](*args, **kwargs)
 
+    @classmethod
+    def operation_kind(cls, name):
+        return ops.meta[name]['kind']
+
     def execute(self, *args, **kwargs):
         return self._client.execute(*args, **kwargs)
 
+    def execute_op(self, name, variables):
+        return self.execute_document(name, ops.document(name), variables)
+
+    def execute_batch(self, name, calls, size=None):
+        size = size or self.batch_size
+        builder = ops.batch(name)
+
+        results = []
+        for i in range(0, len(calls), size):
+            chunk = calls[i:i+size]
+            document, variables = builder.build(chunk)
+            res = self.execute_document(name, document, variables)
+            results.extend(builder.split(len(chunk), res))
+        return results
+
+    def execute_document(self, name, document, variables):
+        return self._client.execute(document, variables)
+
+    def projection(self, name, fields):
+        return Projection(self, name, ops.derive(name, fields), preps[name])
+
+    namespace['batch_size'] = 25
+    namespace['operations'] = ops
     namespace['get_script'] = get_script
     namespace['make_params'] = params
+    namespace['operation_kind'] = operation_kind
     namespace['execute'] = execute
+    namespace['execute_op'] = execute_op
+    namespace['execute_batch'] = execute_batch
+    namespace['execute_document'] = execute_document
+    namespace['projection'] = projection
 
     return type(typeName, (object,), namespace)
 
 
+class Operations:
+    """Compiled operations of a script. Documents are parsed on first use."""
+
+    def __init__(self, meta):
+        self.meta = meta
+        self._documents = {}
+        self._batches = {}
+
+    def document(self, name):
+        doc = self._documents.get(name)
+        if doc is None:
+            from gql import gql
+            doc = gql(self.meta[name]['text'])
+            self._documents[name] = doc
+        return doc
+
+    def batch(self, name):
+        builder = self._batches.get(name)
+        if builder is None:
+            op = self.meta[name]
+            builder = BatchBuilder(op['operation'], op['fragments'])
+            self._batches[name] = builder
+        return builder
+
+    def derive(self, name, fields):
+        """Register a variant of operation name only selecting fields.
+
+        Fields are dotted response paths like 'repository.pullRequest.title'.
+        Selecting a field selects its complete subtree. Returns the name of
+        the derived operation.
+        """
+
+        fields = sorted(set(fields))
+        derived = f"{name}[{','.join(fields)}]"
+        if derived not in self.meta:
+            op = self.meta[name]
+            op_txt, variables = prune(op['operation'], op['fragments'], fields)
+            self.meta[derived] = {
+                'kind': op['kind'],
+                'variables': variables,
+                'text': op_txt,
+                'operation': op_txt,
+                'fragments': "",
+                'batchable': op['batchable'],
+            }
+        return derived
+
+
+class Projection:
+    """Operation bound to a client, selecting a subset of the fields."""
+
+    def __init__(self, client, base, name, prep):
+        self._client = client
+        self._prep = prep
+        self.base = base
+        self.name = name
+        self._variables = set(client.operations.meta[name]['variables'])
+
+    def __call__(self, *args, **kwargs):
+        return self._client.execute_op(self.name, self.params(*args, **kwargs))
+
+    def batch(self, calls, size=None):
+        calls = [self.params(**c) if isinstance(c, dict) else self.params(*c)
+                 for c in calls]
+        if not calls:
+            return []
+        return self._client.execute_batch(self.name, calls, size)
+
+    def params(self, *args, **kwargs):
+        # variables not used by the pruned selection must not be sent
+        params = self._prep(*args, **kwargs)
+        return dict((k, v) for k, v in params.items() if k in self._variables)
+
+
+def prune(op_txt, fragment_txt, fields):
+    from graphql.language.parser import parse
+    from graphql.language.printer import print_ast
+    from graphql.language.ast import (
+        FragmentDefinition, FragmentSpread, InlineFragment, SelectionSet,
+        Variable,
+    )
+
+    doc = parse(op_txt + "\n" + fragment_txt)
+    op = doc.definitions[0]
+    fragments = dict((d.name.value, d) for d in doc.definitions
+                     if isinstance(d, FragmentDefinition))
+    requested = [tuple(f.split('.')) for f in fields]
+
+    # True: path is selected completely, False: path leads to selected
+    # fields, None: path is not selected
+    def wanted(path):
+        found = None
+        for req in requested:
+            if path[:len(req)] == req:
+                return True
+            if req[:len(path)] == path:
+                found = False
+        return found
+
+    def prune_selections(selection_set, path):
+        selections = []
+        for sel in selection_set.selections:
+            if isinstance(sel, FragmentSpread):
+                fragment = fragments[sel.name.value]
+                sel = InlineFragment(type_condition=fragment.type_condition,
+                                     selection_set=fragment.selection_set)
+            if isinstance(sel, InlineFragment):
+                sub = prune_selections(sel.selection_set, path)
+                if sub:
+                    sel = copy.copy(sel)
+                    sel.selection_set = SelectionSet(selections=sub)
+                    selections.append(sel)
+                continue
+
+            key = response_key(sel)
+            if key in always_selected:
+                selections.append(sel)
+                continue
+
+            sub_path = path + (key,)
+            complete = wanted(sub_path)
+            if complete is None:
+                continue
+            if complete or not sel.selection_set:
+                if sel.selection_set and any(
+                        isinstance(n, FragmentSpread) for n in iter_nodes(sel)):
+                    # keep subtree, but resolve fragments
+                    sel = copy.copy(sel)
+                    sel.selection_set = SelectionSet(selections=expand(
+                        sel.selection_set))
+                selections.append(sel)
+                continue
+
+            sub = prune_selections(sel.selection_set, sub_path)
+            if sub:
+                sel = copy.copy(sel)
+                sel.selection_set = SelectionSet(selections=sub)
+                selections.append(sel)
+        return selections
+
+    def expand(selection_set):
+        return [expand_selection(sel) for sel in selection_set.selections]
+
+    def expand_selection(sel):
+        if isinstance(sel, FragmentSpread):
+            fragment = fragments[sel.name.value]
+            sel = InlineFragment(type_condition=fragment.type_condition,
+                                 selection_set=fragment.selection_set)
+        if sel.selection_set:
+            sel = copy.copy(sel)
+            sel.selection_set = SelectionSet(
+                selections=expand(sel.selection_set))
+        return sel
+
+    op = copy.copy(op)
+    op.selection_set = SelectionSet(
+        selections=prune_selections(op.selection_set, ()))
+
+    used = set(n.name.value for n in iter_nodes(op.selection_set)
+               if isinstance(n, Variable))
+    op.variable_definitions = [v for v in op.variable_definitions
+                               if v.variable.name.value in used]
+    variables = [v.variable.name.value for v in op.variable_definitions]
+    return print_ast(op), variables
+
+
+# fields required for pagination and type dispatch are never pruned
+always_selected = set(['cursor', 'pageInfo', '__typename'])
+
+
+def load_compiled(script, cache_dir=None):
+    key = hashlib.sha1(script.encode('utf-8')).hexdigest()
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, f"ops-{key}.json")
+        try:
+            with open(path) as f:
+                compiled = json.load(f)
+            if compiled.get('version') == compiled_version:
+                return compiled['operations']
+        except (OSError, ValueError):
+            pass
+
+    compiled = {
+        'version': compiled_version,
+        'operations': compile_script(script),
+    }
+    if path:
+        from .cache import write_json
+        try:
+            write_json(path, compiled)
+        except OSError:
+            pass
+    return compiled['operations']
+
+
+def compile_script(script):
+    from graphql.language.parser import parse
+    from graphql.language.printer import print_ast
+    from graphql.language.ast import OperationDefinition, FragmentDefinition
+
+    doc = parse(script)
+
+    operations = {}
+    fragments = {}
+    dependencies = {}
+
+    for definition in doc.definitions:
+        if isinstance(definition, OperationDefinition):
+            if definition.name.value in operations:
+                raise Exception(
+                    f"duplicate operation: {definition.name.value}")
+            operations[definition.name.value] = definition
+        elif isinstance(definition, FragmentDefinition):
+            fragments[definition.name.value] = definition
+        else:
+            # ignore node type
+            continue
+
+        deps = [n.name.value for n in iter_fragment_spreads(definition)]
+        dependencies[definition.name.value] = deps
+
+    compiled = {}
+    for name, op in operations.items():
+        deps = transitive_deps(dependencies, name)
+        op_txt = print_ast(op)
+        fragment_txt = "\n".join(print_ast(fragments[dep]) for dep in deps)
+
+        compiled[name] = {
+            'kind': op.operation,
+            'variables': [v.variable.name.value for v in op.variable_definitions],
+            'text': op_txt + "\n" + fragment_txt,
+            'operation': op_txt,
+            'fragments': fragment_txt,
+            'batchable': is_batchable(op, [fragments[dep] for dep in deps]),
+        }
+    return compiled
+
+
 def make_prepare_params(variables):
     def prep(*args, **kwargs):
         if len(args) > len(variables):
@@ -93,12 +341,117 @@ def make_prepare_params(variables):
     return prep
 
 
-def make_exec(prep, code):
+def make_exec(name, prep):
     def fn(self, *args, **kwargs):
-        return self._client.execute(code, prep(*args, **kwargs))
+        return self.execute_op(name, prep(*args, **kwargs))
     return fn
 
 
+def make_batch_exec(name, prep):
+    def fn(self, calls, size=None):
+        """Run the operation once per entry in calls, using as few requests
+        as possible. Each entry is either a tuple of positional parameters
+        or a dict of variables. Results are returned in order.
+        """
+
+        calls = [prep(**c) if isinstance(c, dict) else prep(*c) for c in calls]
+        if not calls:
+            return []
+        return self.execute_batch(name, calls, size)
+    return fn
+
+
+class BatchBuilder:
+    """Rewrites N invocations of an operation into a single document.
+
+    Variables are renamed per invocation (`$user` -> `$user_3`) and top-level
+    fields are aliased (`repository` -> `b3_repository`). Fragments are
+    shared between all invocations.
+    """
+
+    def __init__(self, op_txt, fragment_txt):
+        from graphql.language.parser import parse
+
+        self._op = parse(op_txt).definitions[0]
+        self._fragment_txt = fragment_txt
+        self._fields = [response_key(f) for f in self._op.selection_set.selections]
+        self._documents = {}
+
+    def build(self, calls):
+        from gql import gql
+
+        n = len(calls)
+        if n not in self._documents:
+            self._documents[n] = gql(self._print(n))
+
+        variables = {}
+        for i, call in enumerate(calls):
+            for k, v in call.items():
+                variables[f"{k}_{i}"] = v
+        return self._documents[n], variables
+
+    def split(self, n, data):
+        return [
+            dict((f, data.get(f"b{i}_{f}")) for f in self._fields)
+            for i in range(n)
+        ]
+
+    def _print(self, n):
+        from graphql.language.ast import Name, Variable, SelectionSet
+        from graphql.language.printer import print_ast
+
+        op = copy.copy(self._op)
+        op.name = Name(value=f"{op.name.value}_batch{n}")
+        op.variable_definitions = []
+        selections = []
+        for i in range(n):
+            instance = copy.deepcopy(self._op)
+            for node in iter_nodes(instance):
+                if isinstance(node, Variable):
+                    node.name = Name(value=f"{node.name.value}_{i}")
+            op.variable_definitions.extend(instance.variable_definitions)
+            for field in instance.selection_set.selections:
+                field.alias = Name(value=f"b{i}_{response_key(field)}")
+                selections.append(field)
+        op.selection_set = SelectionSet(selections=selections)
+        return print_ast(op) + "\n" + self._fragment_txt
+
+
+def is_batchable(op, fragments):
+    from graphql.language.ast import Field, Variable
+
+    if not all(isinstance(f, Field) for f in op.selection_set.selections):
+        return False
+
+    # fragments are shared by all calls, so they must not depend on variables
+    for fragment in fragments:
+        if any(isinstance(n, Variable) for n in iter_nodes(fragment)):
+            return False
+    return True
+
+
+def response_key(field):
+    if field.alias:
+        return field.alias.value
+    return field.name.value
+
+
+def iter_nodes(node):
+    from graphql.language.ast import Node
+
+    def walk(node):
+        yield node
+        for attr in node.__slots__:
+            value = getattr(node, attr, None)
+            if isinstance(value, Node):
+                yield from walk(value)
+            elif isinstance(value, list):
+                for v in value:
+                    if isinstance(v, Node):
+                        yield from walk(v)
+    return walk(node)
+
+
 def transitive_deps(dependencies, name):
     visited = set([name])
     workset = [name]
@@ -115,6 +468,8 @@ def transitive_deps(dependencies, name):
 
 
 def iter_fragment_spreads(node):
+    from graphql.language.ast import FragmentSpread
+
     return (f for f in iter_selections(node) if isinstance(f, FragmentSpread))
 
 
@@ -0,0 +1,192 @@
+import json
+import re
+import sys
+from urllib.parse import urlparse
+
+
+class Graph:
+    """Issues and pull requests connected by cross references.
+
+    Nodes are keyed by their GraphQL node id. An edge (source, target)
+    means that source mentions target.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = set()
+        self.roots = []
+
+    def add_node(self, node):
+        if node['id'] not in self.nodes:
+            r = node['repository']
+            self.nodes[node['id']] = {
+                'id': node['id'],
+                'kind': 'pr' if node.get('__typename') == 'PullRequest' else 'issue',
+                'repo': f"{r['owner']['login']}/{r['name']}",
+                'number': node['number'],
+                'state': node['state'],
+                'title': node['title'],
+                'url': node['url'],
+            }
+            return True
+        return False
+
+    def label(self, id):
+        n = self.nodes[id]
+        return f"{n['repo']}#{n['number']}"
+
+
+def traverse(client, roots, depth=2, count=50, size=25, workers=4):
+    """Follow cross references starting at roots (node ids) up to depth.
+
+    The timelines of all nodes on the current frontier are fetched with
+    batched requests, which run concurrently. Timelines are paginated
+    completely, and every node is expanded at most once.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    graph = Graph()
+    graph.roots = list(roots)
+    expanded = set()
+    frontier = list(dict.fromkeys(roots))
+
+    with ThreadPoolExecutor(workers) as pool:
+        for _ in range(depth):
+            if not frontier:
+                break
+            expanded.update(frontier)
+
+            found = []
+            for node, refs in expand(pool, client, frontier, count, size):
+                graph.add_node(node)
+                for source in refs:
+                    graph.add_node(source)
+                    graph.edges.add((source['id'], node['id']))
+                    found.append(source['id'])
+
+            frontier = [id for id in dict.fromkeys(found) if id not in expanded]
+    return graph
+
+
+def expand(pool, client, ids, count, size):
+    """Yield (node, references) for all ids, reading all timeline pages."""
+
+    pending = dict((id, None) for id in ids)
+    refs = dict((id, []) for id in ids)
+    nodes = {}
+    while pending:
+        calls = [(id, count, cursor) for id, cursor in pending.items()]
+        chunks = [calls[i:i + size] for i in range(0, len(calls), size)]
+        results = pool.map(lambda chunk: client.batch_node_references(chunk, size),
+                           chunks)
+
+        pending = {}
+        for chunk, chunk_results in zip(chunks, results):
+            for (id, _, _), res in zip(chunk, chunk_results):
+                node = res['node']
+                if not node or 'timelineItems' not in node:
+                    continue
+                nodes[id] = node
+                timeline = node['timelineItems']
+                refs[id].extend(
+                    e['source'] for e in timeline['nodes']
+                    if e and e.get('source') and 'id' in e['source'])
+                if timeline['pageInfo']['hasNextPage']:
+                    pending[id] = timeline['pageInfo']['endCursor']
+
+    for id in ids:
+        if id in nodes:
+            yield nodes[id], refs[id]
+
+
+def resolve(client, items):
+    """Returns the node ids of (owner, name, number) tuples."""
+
+    ids = []
+    for (user, name, number), res in zip(items, client.batch_item_id(items)):
+        item = res['repository']['issueOrPullRequest']
+        if not item:
+            raise Exception(f"{user}/{name}#{number} not found")
+        ids.append(item['id'])
+    return ids
+
+
+def parse_items(items, path=None):
+    """Parses issue or PR references. Plain numbers refer to the
+    repository of the git project at path."""
+
+    from . import project
+
+    parsed = []
+    for s in items:
+        item = parse_item(s)
+        if item is None:
+            if not s.isdigit():
+                raise Exception(f"{s} must be a number, <owner>/<repo>#<number> or URL")
+            proj = project.open(path)
+            item = (proj.user, proj.name, int(s))
+        parsed.append(item)
+    return parsed
+
+
+def parse_item(s):
+    """Parses '<owner>/<repo>#<number>' or a github URL.
+
+    Returns (owner, name, number), or None if s is not a reference.
+    """
+
+    m = re.match(r"^([^/\s]+)/([^/#\s]+)#(\d+)$", s)
+    if m:
+        return m.group(1), m.group(2), int(m.group(3))
+
+    u = urlparse(s)
+    parts = u.path.split('/')
+    if u.netloc and len(parts) >= 5 and parts[4].isdigit():
+        return parts[1], parts[2], int(parts[4])
+    return None
+
+
+def write_text(graph, out=None):
+    incoming = {}
+    for source, target in graph.edges:
+        incoming.setdefault(target, []).append(source)
+
+    for id, n in graph.nodes.items():
+        root = '*' if id in graph.roots else ' '
+        print(f"{root} {graph.label(id)} {n['kind']} {n['state']} {n['title']}",
+              file=out)
+        print(f"    {n['url']}", file=out)
+        for source in sorted(incoming.get(id, []), key=graph.label):
+            print(f"    <- {graph.label(source)}", file=out)
+
+
+def write_dot(graph, out=None):
+    print("digraph references {", file=out)
+    for id, n in graph.nodes.items():
+        label = f"{graph.label(id)}\n{n['title']}"
+        attrs = [f"label={json.dumps(label)}",
+                 f"URL={json.dumps(n['url'])}",
+                 f"shape={'box' if n['kind'] == 'pr' else 'ellipse'}"]
+        if id in graph.roots:
+            attrs.append("style=bold")
+        print(f"  {json.dumps(id)} [{', '.join(attrs)}];", file=out)
+    for source, target in sorted(graph.edges):
+        print(f"  {json.dumps(source)} -> {json.dumps(target)};", file=out)
+    print("}", file=out)
+
+
+def write_json(graph, out=None):
+    json.dump({
+        'roots': graph.roots,
+        'nodes': list(graph.nodes.values()),
+        'edges': [{'source': s, 'target': t} for s, t in sorted(graph.edges)],
+    }, out or sys.stdout, indent=2)
+    print(file=out)
+
+
+writers = {
+    'text': write_text,
+    'dot': write_dot,
+    'json': write_json,
+}
@@ -1,9 +1,14 @@
+import heapq
+import os
 import re
 from urllib.parse import urlparse
 
 from clidec import namespace, argument, command_name
 
 from . import api
+from . import fmt
+from . import graph
+from . import mirror
 
 
 ns = namespace("issue")
@@ -26,9 +31,10 @@ def info(args):
         user, name = repo.split('/')
         num = int(num)
 
-    client = api.client(args.token)
+    client = api.from_args(args)
     issue = client.query_issue_info(user, name, num)['repository']['issue']
-    fmt.issue_info(issue)
+    with fmt.renderer(args.format, sep="") as render:
+        render.issue(issue)
 
 @ns.command(
     command_name("list"),
@@ -39,11 +45,23 @@ def info(args):
              help='only display issues created by this user'),
     argument("--assignee", default="", help="list issues assigned to this user only"),
     argument("--mentioned", default="", help="list issues with mentioned user only"),
-    argument("repo", default="", help="repository to list issues for")
+    argument("--local", default=False, action='store_true',
+             help="answer from the local mirror (see gh sync)"),
+    argument("--org", default="",
+             help="list issues of all repositories of this organisation (except forks and archived)"),
+    argument("--sort", default="", choices=["", "created", "updated"],
+             help="newest first by creation or update time (default for multiple repositories: updated)"),
+    argument("--workers", default=8, type=int,
+             help="number of repositories fetched concurrently"),
+    argument("repos", nargs="*", help="repositories (<owner>/<repo>) to list issues for")
 )
 def cmd_list(args):
-    owner, repo = args.repo.split("/")
-    client = api.client(args.token)
+    """List issues of one or more repositories. Issues of multiple
+    repositories are merged into one list, newest first."""
+
+    if not args.repos and not args.org:
+        print("repository or --org required")
+        return
 
     labels = args.labels.split(',') if args.labels else None
 
@@ -51,6 +69,25 @@ def cmd_list(args):
     if 'ALL' in states:
         states = []
 
+    if args.local:
+        if args.mentioned:
+            print("--mentioned is not supported with --local")
+            return
+        if args.repos and args.org:
+            print("either repositories or --org are supported with --local")
+            return
+        db = mirror.Mirror(args.mirror)
+        date_field = 'created_at' if args.sort == 'created' else 'updated_at'
+        iter_issues = db.query('issue', repos=args.repos, org=args.org,
+                               states=states, labels=labels, author=args.user,
+                               assignee=args.assignee, date_field=date_field)
+        with fmt.renderer(args.format) as render:
+            for issue in iter_issues:
+                render.issue(issue)
+        return
+
+    client = api.from_args(args)
+
     filters = {}
     if args.assignee:
         filters['assignee'] = args.assignee
@@ -59,9 +96,77 @@ def cmd_list(args):
     if args.mentioned:
         filters['mentioned'] = args.mentioned
 
-    iter_issues = api.iter_gql(client.query_iter_list_issues, 'repository.issues.edges',
-            50, owner, repo, labels, states, filters)
+    repos = list_repos(client, args.repos, args.org)
+    sort = args.sort
+    if not sort and len(repos) > 1:
+        sort = 'updated'
+
+    if len(repos) == 1:
+        owner, repo = repos[0]
+        iter_issues = api.iter_gql(client.query_iter_list_issues, 'repository.issues.edges',
+                50, owner, repo, labels, states, filters, order_by(sort))
+        with fmt.renderer(args.format) as render:
+            for issue in iter_issues:
+                render.issue(issue)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # each repository keeps at most one page buffered while the streams
+    # are merged, so memory stays bounded with many repositories
+    with ThreadPoolExecutor(args.workers) as pool:
+        streams = [api.iter_gql_pool(pool, client.query_iter_list_issues,
+                                     'repository.issues.edges', 50, owner, repo,
+                                     labels, states, filters, order_by(sort))
+                   for owner, repo in repos]
+        field = 'createdAt' if sort == 'created' else 'updatedAt'
+        try:
+            with fmt.renderer(args.format) as render:
+                for issue in heapq.merge(*streams, key=lambda i: i[field],
+                                         reverse=True):
+                    render.issue(issue)
+        finally:
+            for stream in streams:
+                stream.close()
+
+
+def list_repos(client, repos, org=None):
+    """Returns (owner, name) of repos and the repositories of org."""
+
+    found = {}
+    for r in repos:
+        owner, name = r.split("/")
+        found.setdefault(r.lower(), (owner, name))
+    if org:
+        for r in api.iter_gql(client.query_org_repos,
+                              'organization.repositories.edges', 100, org):
+            if not r['isArchived']:
+                found.setdefault(f"{org}/{r['name']}".lower(), (org, r['name']))
+    return list(found.values())
+
+
+def order_by(sort):
+    if not sort:
+        return None
+    field = 'CREATED_AT' if sort == 'created' else 'UPDATED_AT'
+    return {'field': field, 'direction': 'DESC'}
+
+
+@ns.command(
+    command_name("graph"),
+    argument("--depth", default=2, type=int,
+             help="number of cross reference levels to follow"),
+    argument("--output", default="text", choices=sorted(graph.writers),
+             help="graph output format"),
+    argument("--path", default=os.path.curdir, help='git directory'),
+    argument("issues", nargs="+",
+             help="issue number, <owner>/<repo>#<number> or url"),
+)
+def cmd_graph(args):
+    """Show the graph of issues and pull requests cross referencing each
+    other, starting at the given issues."""
 
-    for issue in iter_issues:
-        fmt.issue_info(issue)
-        print()
+    client = api.from_args(args)
+    roots = graph.resolve(client, graph.parse_items(args.issues, args.path))
+    g = graph.traverse(client, roots, depth=args.depth)
+    graph.writers[args.output](g)
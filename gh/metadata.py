@@ -0,0 +1,187 @@
+import atexit
+import os
+import threading
+import time
+
+from . import cache
+
+
+class RepoMetadata:
+    def __init__(self, id=None, labels=None, fetched=0):
+        self.id = id
+        self.labels = labels or {}
+        self.fetched = fetched
+
+    def to_json(self):
+        return {'id': self.id, 'labels': self.labels, 'fetched': self.fetched}
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(obj.get('id'), obj.get('labels'), obj.get('fetched', 0))
+
+
+class Metadata:
+    """Long lived store for data that rarely changes: the viewer login,
+    repository node ids and label name to id maps.
+
+    Lookups are answered from the store file. Entries older than
+    refresh_after are returned as is and refreshed in the background.
+    Entries older than max_age, or missing entries, are fetched before
+    returning. Labels of a repository are fetched with one paginated sweep.
+    Without a path the store only lives in memory.
+    """
+
+    def __init__(self, path, client, refresh_after=3600,
+                 max_age=7 * 24 * 3600):
+        self.path = path
+        self.client = client
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._refreshing = {}
+        self._viewer = None
+        self._repos = {}
+        self._loaded = False
+
+    def viewer_login(self):
+        self._load()
+        return self._get('viewer', lambda: self._viewer,
+                         self._fetch_viewer)['login']
+
+    def stored_viewer_login(self):
+        """Returns the stored viewer login regardless of its age, or None.
+        Never talks to the API."""
+
+        self._load()
+        with self._lock:
+            return (self._viewer or {}).get('login')
+
+    def repo_id(self, owner, name):
+        return self.repo(owner, name).id
+
+    def label_ids(self, owner, name):
+        """Returns the label name to id map of the repository."""
+        return dict(self.repo(owner, name).labels)
+
+    def repo(self, owner, name):
+        self._load()
+        key = f"{owner}/{name}".lower()
+        return self._get(key, lambda: self._repos.get(key),
+                         lambda: self._fetch_repo(key, owner, name))
+
+    def add_labels(self, owner, name, labels):
+        """Store labels found after the last sweep of the repository."""
+
+        key = f"{owner}/{name}".lower()
+        with self._lock:
+            entry = self._repos.get(key)
+            if entry is None:
+                return
+            entry.labels.update(labels)
+        self._save()
+
+    def _get(self, key, current, fetch):
+        with self._lock:
+            entry = current()
+        if entry is None:
+            return fetch()
+        age = time.time() - fetched_at(entry)
+        if age > self.max_age:
+            return fetch()
+        if age > self.refresh_after:
+            self._refresh(key, fetch)
+        return entry
+
+    def _refresh(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            thread = threading.Thread(target=self._run_refresh,
+                                      args=(key, fetch), daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+
+    def _run_refresh(self, key, fetch):
+        try:
+            fetch()
+        except Exception:
+            # keep serving the old entry, the next run retries
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Wait for background refreshes to finish."""
+
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def _fetch_viewer(self):
+        login = self.client.query_viewer_login()['viewer']['login']
+        entry = {'login': login, 'fetched': time.time()}
+        with self._lock:
+            self._viewer = entry
+        self._save()
+        return entry
+
+    def _fetch_repo(self, key, owner, name):
+        from . import api
+
+        id = self.client.query_repo_id(owner, name)['repository']['id']
+        labels = api.iter_gql(self.client.query_repo_labels,
+                              'repository.labels.edges', 100, owner, name)
+        entry = RepoMetadata(id, dict((l['name'], l['id']) for l in labels),
+                             time.time())
+        with self._lock:
+            self._repos[key] = entry
+        self._save()
+        return entry
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.path:
+                return
+            data = cache.read_json(self.path) or {}
+            self._viewer = data.get('viewer')
+            self._repos = dict((k, RepoMetadata.from_json(v))
+                               for k, v in data.get('repos', {}).items())
+
+        # give background refreshes a chance to complete before exit
+        atexit.register(self.wait, 5)
+
+    def _save(self):
+        if not self.path:
+            return
+
+        # merge with entries written by other gh processes in the meantime
+        stored = cache.read_json(self.path) or {}
+        with self._lock:
+            viewer = self._viewer
+            if fetched_at(stored.get('viewer') or {}) > fetched_at(viewer or {}):
+                viewer = stored['viewer']
+            repos = stored.get('repos', {})
+            for k, v in self._repos.items():
+                if v.fetched >= repos.get(k, {}).get('fetched', 0):
+                    repos[k] = v.to_json()
+            data = {'viewer': viewer, 'repos': repos}
+        try:
+            cache.write_json(self.path, data)
+        except OSError:
+            pass
+
+
+def default_path(cache_dir=None):
+    return os.path.join(cache_dir or cache.default_path(), 'metadata.json')
+
+
+def fetched_at(entry):
+    if isinstance(entry, dict):
+        return entry.get('fetched', 0)
+    return entry.fetched
@@ -0,0 +1,293 @@
+import json
+import os
+
+
+def default_path():
+    base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, 'gh', 'mirror.sqlite')
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    high_water TEXT,
+    PRIMARY KEY (repo, kind)
+);
+
+CREATE TABLE IF NOT EXISTS items (
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    state TEXT,
+    author TEXT,
+    title TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    closed_at TEXT,
+    merged_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (repo, kind, number)
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (kind, state, updated_at);
+CREATE INDEX IF NOT EXISTS items_repo ON items (repo, kind, updated_at);
+CREATE INDEX IF NOT EXISTS items_author ON items (author, updated_at);
+CREATE INDEX IF NOT EXISTS items_created ON items (created_at);
+CREATE INDEX IF NOT EXISTS items_closed ON items (closed_at);
+CREATE INDEX IF NOT EXISTS items_merged ON items (merged_at);
+
+CREATE TABLE IF NOT EXISTS item_labels (
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    label TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS item_labels_label ON item_labels (label, repo);
+CREATE INDEX IF NOT EXISTS item_labels_item ON item_labels (repo, kind, number);
+
+CREATE TABLE IF NOT EXISTS item_users (
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    login TEXT NOT NULL,
+    role TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS item_users_login ON item_users (login, role);
+CREATE INDEX IF NOT EXISTS item_users_item ON item_users (repo, kind, number);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    author TEXT,
+    state TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS reviews_item ON reviews (repo, number);
+CREATE INDEX IF NOT EXISTS reviews_author ON reviews (author);
+
+CREATE TABLE IF NOT EXISTS cross_references (
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    source_kind TEXT,
+    source_repo TEXT,
+    source_number INTEGER
+);
+CREATE INDEX IF NOT EXISTS cross_references_item ON cross_references (repo, kind, number);
+CREATE INDEX IF NOT EXISTS cross_references_source ON cross_references (source_repo, source_number);
+
+CREATE TABLE IF NOT EXISTS labels (
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id TEXT,
+    PRIMARY KEY (repo, name)
+);
+"""
+
+
+class Mirror:
+    """Local SQLite copy of issues, pull requests and labels.
+
+    Every item is stored as the JSON document returned by the API, with the
+    fields used for filtering extracted into indexed columns.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def close(self):
+        self.db.close()
+
+    def high_water(self, repo, kind):
+        row = self.db.execute(
+            "SELECT high_water FROM sync_state WHERE repo = ? AND kind = ?",
+            (repo.lower(), kind)).fetchone()
+        return row[0] if row else None
+
+    def set_high_water(self, repo, kind, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sync_state (repo, kind, high_water) "
+            "VALUES (?, ?, ?)", (repo.lower(), kind, value))
+
+    def put_labels(self, repo, labels):
+        repo = repo.lower()
+        self.db.execute("DELETE FROM labels WHERE repo = ?", (repo,))
+        self.db.executemany(
+            "INSERT INTO labels (repo, name, id) VALUES (?, ?, ?)",
+            [(repo, l['name'], l['id']) for l in labels])
+
+    def put_item(self, repo, kind, node):
+        repo = repo.lower()
+        key = (repo, kind, node['number'])
+        for table in ('item_labels', 'item_users', 'cross_references'):
+            self.db.execute(
+                f"DELETE FROM {table} WHERE repo = ? AND kind = ? AND number = ?",
+                key)
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO items (repo, kind, number, state, author, "
+            "title, created_at, updated_at, closed_at, merged_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (
+                node['state'],
+                login(node.get('author')),
+                node['title'],
+                node.get('createdAt'),
+                node.get('updatedAt'),
+                node.get('closedAt'),
+                node.get('mergedAt'),
+                json.dumps(node),
+            ))
+
+        self.db.executemany(
+            "INSERT INTO item_labels (repo, kind, number, label) "
+            "VALUES (?, ?, ?, ?)",
+            [key + (l['name'],) for l in nodes(node.get('labels'))])
+
+        users = [key + (login(node.get('author')), 'author')]
+        users += [key + (u['login'], 'participant')
+                  for u in nodes(node.get('participants'))]
+        users += [key + (u['login'], 'assignee')
+                  for u in nodes(node.get('assignees'))]
+        self.db.executemany(
+            "INSERT INTO item_users (repo, kind, number, login, role) "
+            "VALUES (?, ?, ?, ?, ?)", [u for u in users if u[3]])
+
+        if kind == 'pr':
+            self.db.execute(
+                "DELETE FROM reviews WHERE repo = ? AND number = ?",
+                (repo, node['number']))
+            self.db.executemany(
+                "INSERT INTO reviews (repo, number, author, state, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(repo, node['number'], login(r.get('author')), r['state'],
+                  r['createdAt']) for r in nodes(node.get('reviews'))])
+
+        refs = []
+        for event in nodes(node.get('timelineItems')):
+            source = event.get('source')
+            if not source:
+                continue
+            source_kind, source_repo = source_location(source)
+            refs.append(key + (source_kind, source_repo, source['number']))
+        self.db.executemany(
+            "INSERT INTO cross_references (repo, kind, number, source_kind, "
+            "source_repo, source_number) VALUES (?, ?, ?, ?, ?, ?)", refs)
+
+    def commit(self):
+        self.db.commit()
+
+    def query(self, kind, repos=None, states=None, labels=None, author=None,
+              assignee=None, involves=None, org=None, date_field='updated_at',
+              since=None):
+        """Returns matching items ordered by date_field, newest first."""
+
+        where = ["i.kind = ?"]
+        params = [kind]
+        if repos:
+            where.append(f"i.repo IN ({','.join('?' * len(repos))})")
+            params += [r.lower() for r in repos]
+        if org:
+            where.append("i.repo LIKE ?")
+            params.append(f"{org.lower()}/%")
+        if states:
+            where.append(f"i.state IN ({','.join('?' * len(states))})")
+            params += states
+        if author:
+            where.append("i.author = ?")
+            params.append(author)
+        for role, user in (('assignee', assignee), (None, involves)):
+            if not user:
+                continue
+            clause = ("EXISTS (SELECT 1 FROM item_users u WHERE u.repo = i.repo "
+                      "AND u.kind = i.kind AND u.number = i.number AND u.login = ?")
+            params.append(user)
+            if role:
+                clause += " AND u.role = ?"
+                params.append(role)
+            where.append(clause + ")")
+        for label in labels or []:
+            where.append(
+                "EXISTS (SELECT 1 FROM item_labels l WHERE l.repo = i.repo "
+                "AND l.kind = i.kind AND l.number = i.number AND l.label = ?)")
+            params.append(label)
+        if since:
+            where.append(f"i.{date_field} >= ?")
+            params.append(since)
+
+        sql = (f"SELECT i.data FROM items i WHERE {' AND '.join(where)} "
+               f"ORDER BY i.{date_field} DESC")
+        for (data,) in self.db.execute(sql, params):
+            yield json.loads(data)
+
+
+def sync_repo(client, db, repo, count=50):
+    """Fetch all issues and PRs of repo updated since the last sync.
+
+    Items are requested in descending updatedAt order, so fetching stops
+    at the first item older than the stored high water mark.
+    """
+
+    from . import api
+
+    owner, name = repo.split('/')
+    labels = api.iter_gql(client.query_repo_labels, 'repository.labels.edges',
+                          100, owner, name)
+    db.put_labels(repo, list(labels))
+
+    stats = {}
+    for kind, fn, key in (
+            ('issue', client.query_sync_issues, 'repository.issues.edges'),
+            ('pr', client.query_sync_prs, 'repository.pullRequests.edges')):
+        high_water = db.high_water(repo, kind)
+        latest = high_water
+        n = 0
+        nodes = api.iter_gql(fn, key, count, owner, name)
+        try:
+            for node in nodes:
+                updated = node['updatedAt']
+                if high_water and updated < high_water:
+                    break
+                db.put_item(repo, kind, node)
+                if not latest or updated > latest:
+                    latest = updated
+                n += 1
+        finally:
+            nodes.close()
+
+        db.set_high_water(repo, kind, latest)
+        db.commit()
+        stats[kind] = n
+    return stats
+
+
+def format_time(d):
+    return d.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def nodes(conn):
+    if not conn:
+        return []
+    return conn.get('nodes') or []
+
+
+def login(user):
+    if user and 'login' in user:
+        return user['login']
+    return None
+
+
+def source_location(source):
+    kind = 'pr' if source.get('__typename') == 'PullRequest' else 'issue'
+    if 'repository' in source:
+        r = source['repository']
+        return kind, f"{r['owner']['login']}/{r['name']}".lower()
+    if 'permalink' in source:
+        # https://github.com/<owner>/<repo>/pull/<number>
+        parts = source['permalink'].split('/')
+        return kind, f"{parts[3]}/{parts[4]}".lower()
+    return kind, None
@@ -1,17 +1,18 @@
 from urllib.parse import urlparse
 import datetime
-import editor
 import os
 import re
-import tempfile
 import textwrap
-import webbrowser
+import time
 
 from clidec import namespace, command_name, argument
 
 from . import project
 from . import api
 from . import fmt
+from . import graph
+from . import mirror
+from . import search
 from .util import parse_timedelta
 
 
@@ -26,6 +27,8 @@ ns = namespace("pr")
                  help='pr states (open, closed, merged, all)'),
         argument("--labels", default="", help='pr labels'),
         argument("--title", default="", help='title regex filter'),
+        argument("--no-pushdown", default=False, action='store_true',
+                 help='list all PRs of the user and filter locally'),
         argument("user", default="", nargs='?',
                  help='git user to filter for'),
 )
@@ -51,7 +54,7 @@ def userlist(args):
     def show(x):
         return filter_repo(x) and filter_title(x)
 
-    client = api.client(args.token)
+    client = api.from_args(args)
 
     states = [s.upper() for s in args.states.split(',')]
     if 'ALL' in states:
@@ -61,15 +64,76 @@ def userlist(args):
 
     user = args.user
     if not user:
-        user = client.query_viewer_login()['viewer']['login']
+        user = client.metadata.viewer_login()
+
+    if args.no_pushdown:
+        iter_pulls = api.iter_gql(client.query_user_prs, 'user.pullRequests.edges',
+                                  50, user, states, labels)
+    else:
+        query, residual = plan_userlist(user, states, labels, args.repo,
+                                        args.title)
+        iter_pulls = (pr for pr in search.iter_search(
+            client.query_user_prs_search, query, 'created') if residual(pr))
+
+    with fmt.renderer(args.format) as render:
+        for pr in iter_pulls:
+            if show(pr):
+                render.pr(pr)
 
-    iter_pulls = api.iter_gql(client.query_user_prs, 'user.pullRequests.edges',
-                              50, user, states, labels)
 
-    for pr in iter_pulls:
-        if show(pr):
-            fmt.pr_info(pr)
-            print()
+def plan_userlist(user, states, labels, repo, title):
+    """Translate userlist filters into search qualifiers.
+
+    Returns the qualifiers and a predicate for the filters that can not be
+    expressed in the search query. Only qualifiers matching a superset of
+    the filter are pushed down. Repository and title regexes are always
+    re-applied by the caller.
+    """
+
+    query = ["type:pr", f"author:{user}", "sort:created-asc"]
+    residual = []
+
+    state_qualifiers = {
+        'OPEN': ["is:open"],
+        'CLOSED': ["is:closed", "is:unmerged"],
+        'MERGED': ["is:merged"],
+    }
+    if len(states) == 1 and states[0] in state_qualifiers:
+        query += state_qualifiers[states[0]]
+    elif states:
+        residual.append(lambda pr: pr['state'] in states)
+
+    if labels and len(labels) == 1 and '"' not in labels[0]:
+        query.append(f'label:"{labels[0]}"')
+    elif labels:
+        residual.append(lambda pr: any(
+            l['name'] in labels for l in pr['labels']['nodes']))
+
+    # The repository regex is matched as substring, so only anchored
+    # patterns select a single repository ('^owner/name$') or owner
+    # ('^owner/'). Titles are not pushed down: search matches words, not
+    # substrings.
+    owner, name = anchored_repo(repo)
+    if owner and name:
+        query.append(f"repo:{owner}/{name}")
+    elif owner:
+        query.append(f"user:{owner}")
+
+    return query, lambda pr: all(f(pr) for f in residual)
+
+
+def anchored_repo(pattern):
+    """Returns (owner, name) for '^owner/name$' and (owner, None) for
+    '^owner/' patterns, (None, None) for everything else. Dots in names
+    must be escaped."""
+
+    m = re.fullmatch(r"\^([A-Za-z0-9-]+)/((?:[\w-]|\\\.)+\$)?", pattern or "")
+    if not m:
+        return None, None
+    name = m.group(2)
+    if name:
+        name = name[:-1].replace('\\.', '.')
+    return m.group(1), name
 
 
 @ns.command(
@@ -78,15 +142,18 @@ def userlist(args):
         argument("pr", nargs="?", help="pull request id"),
 )
 def info(args):
-    client = api.client(args.token)
+    client = api.from_args(args)
     if not args.pr:
         prs = find_branch_prs(client, args.path, args.remote)
         if len(prs) == 0:
             print("No PRs found")
-        for pr in prs:
-            fmt.pr_info(fetch_pr_info(client, args, pr['number']))
+        prs = fetch_pr_infos(client, args, [p['number'] for p in prs])
     else:
-        fmt.pr_info(fetch_pr_info(client, args, args.pr))
+        prs = [fetch_pr_info(client, args, args.pr)]
+
+    with fmt.renderer(args.format, sep="") as render:
+        for pr in prs:
+            render.pr(pr)
 
 
 @ns.command(
@@ -95,13 +162,14 @@ def info(args):
         argument("commit", help="commit id"),
 )
 def of(args):
-    client = api.client(args.token)
+    client = api.from_args(args)
     prs = find_commit_prs(client, args.path, args.remote, args.commit)
     if len(prs) == 0:
         print("No PRs found")
 
-    for pr in prs:
-        fmt.pr_info(fetch_pr_info(client, args, pr['number']))
+    with fmt.renderer(args.format, sep="") as render:
+        for pr in fetch_pr_infos(client, args, [p['number'] for p in prs]):
+            render.pr(pr)
 
 
 @ns.command(
@@ -110,7 +178,7 @@ def of(args):
         argument("pr", nargs="?", type=int, help="pull request id"),
 )
 def open(args):
-    client = api.client(args.token)
+    client = api.from_args(args)
     proj = project.open(args.path)
 
     if not args.pr:
@@ -118,9 +186,12 @@ def open(args):
         if len(prs) == 0:
             print("No PRs found")
     else:
-        resp = client.query_pr_info(proj.user, proj.name, args.pr)
+        query = client.projection(
+            'pr_info', ['repository.pullRequest.permalink'])
+        resp = query(proj.user, proj.name, args.pr)
         prs = [resp['repository']['pullRequest']]
 
+    import webbrowser
     for pr in prs:
         webbrowser.open(pr['permalink'])
 
@@ -128,48 +199,69 @@ def open(args):
 @ns.command(
         argument("--path", default=os.path.curdir, help='git directory'),
         argument("--remote", default="origin", help='git remote '),
-        argument("label", help="label to add"),
+        argument("--remove", default="",
+                 help="comma separated labels to remove"),
+        argument("label", help="comma separated labels to add"),
         argument("prs", nargs="+", type=int, help="pull request id"),
 )
 def all_addlabel(args):
-    client = api.client(args.token)
+    client = api.from_args(args)
     proj = project.open(args.path)
 
-    if args.remote:
-        remote = proj.repo.remotes[args.remote]
-    else:
-        remote = proj.origin
-
     if proj.has_remote('upstream'):
         target_owner, target_repo = proj.repo_owner('upstream')
     else:
-        target_owner, target_repo = proj.repo_owner(remote.name)
+        target_owner, target_repo = proj.repo_owner(args.remote or 'origin')
+
+    add = [l for l in args.label.split(',') if l]
+    remove = [l for l in args.remove.split(',') if l]
 
     pr_ids = []
-    for number in args.prs:
-        res = client.query_repo_pr_id(target_owner, target_repo, number)
+    results = client.batch_repo_pr_id(
+        [(target_owner, target_repo, number) for number in args.prs])
+    for res in results:
         id = res["repository"]["pullRequest"]["id"]
         pr_ids.append(id)
 
-    label_id = None
-    iter_labels = api.iter_gql(
-            client.query_repo_label_ids, 'repository.labels.edges',
-            20, target_owner, target_repo, args.label)
-    for label in iter_labels:
-        if label['name'] == args.label:
-            label_id = label['id']
+    label_ids = resolve_labels(client, target_owner, target_repo, add + remove)
+    missing = [l for l in add + remove if l not in label_ids]
+    if missing:
+        print(f"unknown labels: {', '.join(missing)}")
+        return
 
+    set_labels(client, pr_ids,
+               add=[label_ids[l] for l in add],
+               remove=[label_ids[l] for l in remove])
 
-    if not label_id:
-        print(f"unknown label {args.label}")
-        return
-    label_ids = [label_id]
 
-    for pr in pr_ids:
-        client.mut_add_labels({
-            "labelableId": pr,
-            "labelIds": label_ids,
-        })
+def resolve_labels(client, owner, repo, names):
+    """Returns the ids of the labels names. Labels are taken from the
+    metadata store, labels not found there are looked up with a single
+    batched query. Unknown labels are not included."""
+
+    known = client.metadata.label_ids(owner, repo)
+    ids = dict((name, known[name]) for name in names if name in known)
+    missing = [name for name in dict.fromkeys(names) if name not in ids]
+    if missing:
+        results = client.batch_repo_label(
+            [(owner, repo, name) for name in missing], size=100)
+        found = dict((name, res['repository']['label']['id'])
+                     for name, res in zip(missing, results)
+                     if res['repository']['label'])
+        client.metadata.add_labels(owner, repo, found)
+        ids.update(found)
+    return ids
+
+
+def set_labels(client, ids, add=(), remove=(), size=50):
+    """Add and remove labels on all issues or PRs in ids, using batched
+    mutations."""
+
+    for batch, label_ids in ((client.batch_add_labels, add),
+                             (client.batch_remove_labels, remove)):
+        if label_ids:
+            batch([({"labelableId": id, "labelIds": list(label_ids)},)
+                   for id in ids], size=size)
 
 
 @ns.command(
@@ -183,6 +275,8 @@ def all_addlabel(args):
              help='issue order (<field>-<direction>)'),
     argument("--event", default="updated",
              help='find issues by event type (created, updated, merged, closed)'),
+    argument("--local", default=False, action='store_true',
+             help="answer from the local mirror (see gh sync)"),
 )
 def list_prs(args):
     event_types = {
@@ -204,12 +298,17 @@ def list_prs(args):
       },
     }
 
-    client = api.client(args.token)
     repo = args.repo
     if not repo:
         proj = project.open(".", remote=args.remote)
         repo = f"{proj.user}/{proj.name}"
 
+    if args.local:
+        list_local_prs(args, repo)
+        return
+
+    client = api.from_args(args)
+
     query = [f"repo:{repo}"]
     for label in args.labels:
         query += [f"label:{label}"]
@@ -220,16 +319,42 @@ def list_prs(args):
     query += event_type['filters']
     date_filter_key = event_type['date_filter']
 
+    since = None
     if args.last:
         delta = parse_timedelta(args.last)
         since = datetime.datetime.utcnow() - delta
-        query += [f"{date_filter_key}:{since.replace(microsecond=0).isoformat()}..*"]
 
-    iter_prs = api.iter_gql(client.query_user_prs_search, 'search.edges',
-            50, " ".join(["type:pr"] + query))
-    for pr in iter_prs:
-        fmt.pr_info(pr)
-        print("\n")
+    iter_prs = search.iter_search(client.query_user_prs_search,
+            ["type:pr"] + query, date_filter_key, since)
+    with fmt.renderer(args.format, sep="\n\n") as render:
+        for pr in iter_prs:
+            render.pr(pr)
+
+
+def list_local_prs(args, repo):
+    event_types = {
+        "updated": (["OPEN"], "updated_at"),
+        "created": (["OPEN"], "created_at"),
+        "closed": (["CLOSED"], "closed_at"),
+        "merged": (["MERGED"], "merged_at"),
+    }
+    if args.event not in event_types:
+        print(f"Unknown event type {args.event}. Must be one of {event_types.keys()}")
+        return
+    states, date_field = event_types[args.event]
+
+    since = None
+    if args.last:
+        delta = parse_timedelta(args.last)
+        since = mirror.format_time(datetime.datetime.utcnow() - delta)
+
+    labels = args.labels.split(',') if args.labels else None
+    db = mirror.Mirror(args.mirror)
+    iter_prs = db.query('pr', repos=[repo], states=states, labels=labels,
+                        date_field=date_field, since=since)
+    with fmt.renderer(args.format, sep="\n\n") as render:
+        for pr in iter_prs:
+            render.pr(pr)
 
 
 @ns.command(
@@ -249,7 +374,7 @@ def create(args):
     else:
         remote = proj.origin
 
-    client = api.client(args.token)
+    client = api.from_args(args)
 
     if branch.name not in proj.remote.refs:
         proj.repo.git.push(
@@ -278,24 +403,17 @@ def create(args):
     else:
         headRef = f"{remote_owner}:{branch.name}"
 
-    target = client.query_repo_id(target_owner, target_repo)
+    target_id = client.metadata.repo_id(target_owner, target_repo)
 
     label_ids = []
     if args.labels:
         labels = args.labels.split(",")
-        found = set()
-        iter_labels = api.iter_gql(
-            client.query_repo_label_ids, 'repository.labels.edges',
-            20, target_owner, target_repo, " ".join(labels))
-        for label in iter_labels:
-            if label['name'] in labels:
-                found.add(label['name'])
-                label_ids.append(label['id'])
-
-        if len(labels) != len(found):
-            missing = set(labels).difference(found)
-            print(f"unknown labels: {missing}")
+        found = resolve_labels(client, target_owner, target_repo, labels)
+        missing = [l for l in labels if l not in found]
+        if missing:
+            print(f"unknown labels: {', '.join(missing)}")
             exit(1)
+        label_ids = [found[l] for l in labels]
 
     msg = textwrap.dedent("""
 
@@ -312,6 +430,7 @@ def create(args):
     if len(logs) > 1: # first reflog entry is 'branch command'
         commit = proj.repo.commit(logs[1].newhexsha)
         msg = commit.message + msg
+    import editor  # slow to import, only needed here
     msg = editor.edit(contents=msg).decode()
 
     msg = [l for l in msg.split('\n') if not l.startswith('#')]
@@ -332,7 +451,7 @@ def create(args):
         "maintainerCanModify": True,
         "headRefName": headRef,
         "baseRefName": args.branch,
-        "repositoryId": target['repository']['id'],
+        "repositoryId": target_id,
     }
 
     if args.draft:
@@ -351,37 +470,190 @@ def create(args):
     print(f"{pr['headRefName']}")
     print(f"{pr['permalink']}\n")
 
-    client.mut_add_labels({
-        "labelableId": pr['id'],
-        "labelIds": label_ids,
-    })
+    set_labels(client, [pr['id']], add=label_ids)
 
 
-def fetch_pr_info(client, args, pr):
+
+@ns.command(
+    command_name("graph"),
+    argument("--depth", default=2, type=int,
+             help="number of cross reference levels to follow"),
+    argument("--output", default="text", choices=sorted(graph.writers),
+             help="graph output format"),
+    argument("--path", default=os.path.curdir, help='git directory'),
+    argument("prs", nargs="+",
+             help="pull request number, <owner>/<repo>#<number> or url"),
+)
+def cmd_graph(args):
+    """Show the graph of issues and pull requests cross referencing each
+    other, starting at the given pull requests."""
+
+    client = api.from_args(args)
+    roots = graph.resolve(client, graph.parse_items(args.prs, args.path))
+    g = graph.traverse(client, roots, depth=args.depth)
+    graph.writers[args.output](g)
+
+
+# fields of pr_info polled by watch
+watch_fields = [
+    'repository.pullRequest.state',
+    'repository.pullRequest.reviews',
+    'repository.pullRequest.commits.nodes.commit.status.state',
+    'repository.pullRequest.commits.nodes.commit.status.contexts.context',
+    'repository.pullRequest.commits.nodes.commit.status.contexts.state',
+]
+
+
+@ns.command(
+        argument("--path", default=os.path.curdir, help='git directory'),
+        argument("--remote", default="origin", help='git remote '),
+        argument("--interval", default=10, type=float,
+                 help="seconds between polls after a change"),
+        argument("--max-interval", default=120, type=float,
+                 help="max seconds between polls while nothing changes"),
+        argument("--checks-timeout", default=300, type=float,
+                 help="seconds to wait for checks on PRs without any"),
+        argument("prs", nargs="*",
+                 help="pull request ids or urls (default: PRs of current branch)"),
+)
+def watch(args):
+    """Poll CI status and reviews of pull requests, print changes, and
+    exit once all checks are done or the PRs are closed. Exits with 1 if a
+    check failed. Open PRs without a status are waited on until checks are
+    reported, at most --checks-timeout seconds."""
+
+    client = api.from_args(args)
+    prs = args.prs
+    if not prs:
+        prs = [str(p['number'])
+               for p in find_branch_prs(client, args.path, args.remote)]
+        if not prs:
+            print("No PRs found")
+            return
+
+    calls = pr_calls(args, prs)
+    query = client.projection('pr_info', watch_fields)
+    interval = args.interval
+    started = time.time()
+    no_checks = set()
+    previous = {}
     try:
-        u = urlparse(pr)
-        tmp = u.path.split('/')
-        user, name, pr = tmp[1], tmp[2], int(tmp[4])
-    except:
-        if not isnum(pr):
-            raise f"{pr} must be a number of URL"
-        proj = project.open(args.path)
-        user, name, pr = proj.user, proj.name, int(pr)
+        while True:
+            changed = False
+            states = {}
+            for (user, name, number), res in zip(calls, query.batch(calls, size=50)):
+                key = f"{user}/{name}#{number}"
+                pr = res['repository']['pullRequest']
+                if not pr:
+                    raise Exception(f"{key} not found")
+                states[key] = state = watch_state(pr)
+                for msg in watch_changes(previous.get(key), state):
+                    print(f"{key}: {msg}", flush=True)
+                    changed = True
+            previous = states
+
+            if time.time() - started > args.checks_timeout:
+                for key, s in states.items():
+                    if not s['settled'] and s['status'] is None:
+                        if key not in no_checks:
+                            print(f"{key}: no checks reported", flush=True)
+                            no_checks.add(key)
+                        s['settled'] = True
+
+            if all(s['settled'] for s in states.values()):
+                failed = any(s['status'] in ('FAILURE', 'ERROR')
+                             for s in states.values())
+                exit(1 if failed else 0)
+
+            if changed:
+                interval = args.interval
+            else:
+                interval = min(args.max_interval, interval * 1.5)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        exit(130)
+
+
+def watch_state(pr):
+    status = None
+    contexts = {}
+    commits = pr['commits']['nodes']
+    if commits and commits[-1]['commit']['status']:
+        status = commits[-1]['commit']['status']
+        contexts = dict((c['context'], c['state']) for c in status['contexts'])
+        status = status['state']
+
+    reviews = {}
+    for review in pr['reviews']['nodes']:
+        author = (review['author'] or {}).get('login', '<unknown>')
+        reviews[author] = review['state']
+
+    return {
+        'state': pr['state'],
+        'status': status,
+        'contexts': contexts,
+        'reviews': reviews,
+        # no status yet: checks may not have been reported for the commit
+        'settled': pr['state'] != 'OPEN' or status not in (
+            None, 'PENDING', 'EXPECTED'),
+    }
+
+
+def watch_changes(old, new):
+    """Yields a message per changed field."""
+
+    old = old or {'state': None, 'status': None, 'contexts': {}, 'reviews': {}}
+    if old['state'] != new['state']:
+        yield f"state {new['state']}"
+    if old['status'] != new['status'] and new['status']:
+        yield f"status {new['status']}"
+    for context, state in sorted(new['contexts'].items()):
+        if old['contexts'].get(context) != state:
+            yield f"check {context}: {state}"
+    for author, state in sorted(new['reviews'].items()):
+        if old['reviews'].get(author) != state:
+            yield f"review by {author}: {state}"
+
+
+def fetch_pr_info(client, args, pr):
+    return fetch_pr_infos(client, args, [pr])[0]
+
 
-    resp = client.query_pr_info(user, name, pr)
-    return resp['repository']['pullRequest']
+def fetch_pr_infos(client, args, prs):
+    return [resp['repository']['pullRequest']
+            for resp in client.batch_pr_info(pr_calls(args, prs))]
+
+
+def pr_calls(args, prs):
+    """Returns (owner, repo, number) for PR numbers or URLs."""
+
+    proj = None
+    calls = []
+    for pr in prs:
+        try:
+            u = urlparse(pr)
+            tmp = u.path.split('/')
+            user, name, pr = tmp[1], tmp[2], int(tmp[4])
+        except:
+            if not isnum(pr):
+                raise Exception(f"{pr} must be a number or URL")
+            if not proj:
+                proj = project.open(args.path)
+            user, name, pr = proj.user, proj.name, int(pr)
+        calls.append((user, name, pr))
+    return calls
 
 
 def find_branch_prs(client, path, remote=None):
     proj = project.open(path, remote=remote)
-    branch = proj.active_branch
-    if branch.name not in proj.remote.refs:
-        raise "Branch {} not found in remote {}".format(
-            proj.repo.head.ref.name,
-            proj.remote.name,
-        )
-
-    ref = f"refs/heads/{proj.repo.head.ref.name}"
+    branch = proj.active_branch_name
+    if not proj.has_remote_branch(branch):
+        raise Exception("Branch {} not found in remote {}".format(
+            branch,
+            proj.remote_name,
+        ))
+
+    ref = f"refs/heads/{branch}"
     resp = client.query_branch_prs(proj.user, proj.name, ref)
     return resp['repository']['ref']['associatedPullRequests']['nodes']
 
@@ -1,28 +1,43 @@
-import git
+import builtins
+import os
 import re
+import threading
+
+from . import trace
 
 
 class Project:
-    def __init__(self, repo, remote=None):
+    """Git repository and the GitHub repository of one of its remotes.
+
+    Read-only queries (remotes, active branch, refs) are answered by a
+    reader. GitPython is only imported once `repo` is used, e.g. to push or
+    to modify branches.
+    """
+
+    def __init__(self, reader, remote=None):
         remotes = ['upstream', 'origin']
         if remote:
             remotes = [remote]
 
-        def find_remote(remotes, names):
-            for name in names:
-                for remote in remotes:
-                    if remote.name == name:
-                        return remote
-            return None
+        self.reader = reader
+        self._remotes = reader.remotes()
+        self._repo = None
 
-        remote = find_remote(repo.remotes, remotes)
-        if not remote:
-            raise f"remotes do not exist: {remotes}"
+        names = [name for name in remotes if name in self._remotes]
+        if not names:
+            raise Exception(f"remotes do not exist: {remotes}")
+        self.remote_name = names[0]
+        self.user, self.name = github_url_owner(self._remotes[self.remote_name])
 
-        self.repo = repo
-        self.remote = remote
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = open_repo(self.reader.path)
+        return self._repo
 
-        self.user, self.name = github_url_owner(remote.url)
+    @property
+    def remote(self):
+        return self.repo.remotes[self.remote_name]
 
     @property
     def origin(self):
@@ -30,43 +45,152 @@ class Project:
 
     @property
     def upstream(self):
-        if 'upstream' in self.repo.remotes:
+        if 'upstream' in self._remotes:
             return self.repo.remotes['upstream']
 
     @property
     def active_branch(self):
         return self.repo.head.ref
 
+    @property
+    def active_branch_name(self):
+        return self.reader.head_branch()
+
+    def branch_names(self):
+        return set(self.reader.refs('refs/heads/'))
+
+    def has_remote_branch(self, branch, remote=None):
+        remote = remote or self.remote_name
+        return branch in self.reader.refs(f"refs/remotes/{remote}/")
+
     def has_remote(self, name):
-        try:
-            self.repo.remote(name)
-            return True
-        except:
-            return False
+        return name in self._remotes
 
     def repo_owner(self, remote_name):
-        r = self.repo.remote(remote_name)
-        return github_url_owner(r.url)
+        if remote_name not in self._remotes:
+            raise Exception(f"remote does not exist: {remote_name}")
+        return github_url_owner(self._remotes[remote_name])
 
     def worktrees(self):
         heads = dict((h.path, h) for h in self.repo.heads)
-        output = self.repo.git.worktree("list", "--porcelain")
-        lines = [l for l in output.splitlines() if len(l) > 0]
         worktrees = []
-        while lines:
-            [wd, _commit_id, br, *lines] = lines
-            if not wd.startswith('worktree '):
-                raise "expected worktree name"
-            if not br.startswith('branch '):
-                raise "expected branch name"
-            wd = wd[len("worktree "):]
-            br = br[len("branch "):]
+        for wd, br in self.worktree_refs():
             if br not in heads:
                 continue
-            br = heads[br]
-            worktrees.append(Worktree(self.repo, wd, br))
+            worktrees.append(Worktree(self.repo, wd, heads[br]))
         return worktrees
 
+    def worktree_refs(self):
+        """List (path, ref) of all worktrees having a branch checked out."""
+
+        output = self.repo.git.worktree("list", "--porcelain")
+        return parse_worktrees(output)
+
+    def gone_branches(self):
+        """Names of local branches whose upstream branch has been deleted.
+
+        Uses a single for-each-ref call, instead of resolving the tracking
+        branch of every head.
+        """
+
+        output = self.repo.git.for_each_ref(
+            '--format=%(refname:lstrip=2)%00%(upstream:track)', 'refs/heads')
+        gone = []
+        for line in output.splitlines():
+            name, _, track = line.partition('\0')
+            if track == '[gone]':
+                gone.append(name)
+        return gone
+
+    def remove_worktrees(self, paths, workers=4):
+        """Remove worktrees concurrently.
+
+        Returns a dict mapping each path to None if removed, or the error.
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def remove(path):
+            try:
+                self.repo.git.worktree("remove", path)
+                return None
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(paths, pool.map(remove, paths)))
+
+    def delete_branches(self, names):
+        """Force delete local branches using a single git command.
+
+        Returns a dict mapping each name to None if deleted, or the error
+        reported by git.
+        """
+
+        if not names:
+            return {}
+        _, out, err = self.repo.git.branch(
+            '-D', *names, with_extended_output=True, with_exceptions=False)
+        deleted = set()
+        for line in out.splitlines():
+            m = re.match(r"Deleted branch (\S+)", line)
+            if m:
+                deleted.add(m.group(1))
+        return dict((name, None if name in deleted else branch_error(err, name))
+                    for name in names)
+
+    def delete_remote_branches(self, names, chunk_size=100):
+        """Delete branches on the selected remote with as few pushes as
+        possible.
+
+        Returns a dict mapping each name to None if deleted, or the error
+        reported by git.
+        """
+
+        results = {}
+        for i in range(0, len(names), chunk_size):
+            chunk = names[i:i + chunk_size]
+            _, out, err = self.repo.git.push(
+                '--porcelain', '--delete', self.remote_name, *chunk,
+                with_extended_output=True, with_exceptions=False)
+
+            # porcelain lines: <flag>\t<from>:<to>\t<summary>
+            status = {}
+            for line in out.splitlines():
+                fields = line.split('\t')
+                if len(fields) < 3 or ':refs/heads/' not in fields[1]:
+                    continue
+                name = fields[1].split(':refs/heads/', 1)[1]
+                status[name] = None if fields[0] == '-' else fields[2]
+            for name in chunk:
+                if name in status:
+                    results[name] = status[name]
+                else:
+                    results[name] = branch_error(err, name)
+        return results
+
+
+def parse_worktrees(output):
+    # porcelain output has one attribute per line, worktrees are separated
+    # by empty lines. Detached or bare worktrees have no branch line.
+    worktrees = []
+    path = None
+    for line in output.splitlines() + ['']:
+        if line.startswith('worktree '):
+            path = line[len('worktree '):]
+        elif line.startswith('branch ') and path:
+            worktrees.append((path, line[len('branch '):]))
+        elif not line:
+            path = None
+    return worktrees
+
+
+def branch_error(err, name):
+    for line in err.splitlines():
+        if f"'{name}'" in line:
+            return line
+    return err.strip() or "unknown error"
+
 
 class Worktree:
     def __init__(self, repo, path, branch):
@@ -83,14 +207,182 @@ class Remote:
         self._obj = ref
 
 
-def open(path=None, **kwargs):
+_projects = {}
+_projects_lock = threading.Lock()
+
+
+def open(path=None, remote=None):
+    """Returns the Project for path. Projects are shared per process, so
+    repository discovery only happens once per path and remote."""
+
     if not path:
         path = os.path.curdir
-    return Project(open_repo(path), **kwargs)
+    key = (os.path.abspath(path), remote)
+    with _projects_lock:
+        proj = _projects.get(key)
+        if proj is None:
+            with trace.span('project.open', cat='git', path=path):
+                proj = Project(open_reader(path), remote=remote)
+            _projects[key] = proj
+        return proj
+
+
+def refresh():
+    """Forget refs read by open projects, and projects whose remotes
+    changed. Used by long running processes before each command."""
+
+    with _projects_lock:
+        for key, proj in list(_projects.items()):
+            if proj.reader.remotes() != proj._remotes:
+                del _projects[key]
+            else:
+                proj.reader.reset()
 
 
 def open_repo(path):
-    return git.Repo(path, search_parent_directories=True)
+    with trace.span('git.Repo', cat='git', path=path):
+        import git
+        return git.Repo(path, search_parent_directories=True)
+
+
+def open_reader(path):
+    reader = GitDirReader.find(path)
+    if reader is None:
+        reader = RepoReader(open_repo(path))
+    return reader
+
+
+class GitDirReader:
+    """Answers read-only queries by parsing the files in the .git directory.
+
+    Supports the common layouts: regular checkouts and linked worktrees,
+    with loose and packed refs.
+    """
+
+    def __init__(self, path, git_dir, common_dir):
+        self.path = path
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self._refs = None
+
+    @classmethod
+    def find(cls, path):
+        path = os.path.abspath(path)
+        while True:
+            dotgit = os.path.join(path, '.git')
+            if os.path.isdir(dotgit):
+                return cls(path, dotgit, dotgit)
+            if os.path.isfile(dotgit):
+                return cls.from_link(path, dotgit)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    @classmethod
+    def from_link(cls, path, dotgit):
+        # linked worktree: .git is a file pointing at the worktree git dir,
+        # which references the common directory of the main repository.
+        content = read_file(dotgit)
+        if not content or not content.startswith('gitdir:'):
+            return None
+        git_dir = os.path.join(path, content[len('gitdir:'):].strip())
+        common_dir = git_dir
+        commondir = read_file(os.path.join(git_dir, 'commondir'))
+        if commondir:
+            common_dir = os.path.join(git_dir, commondir.strip())
+        return cls(path, os.path.normpath(git_dir), os.path.normpath(common_dir))
+
+    def remotes(self):
+        config = parse_config(read_file(os.path.join(self.common_dir, 'config')) or "")
+        return dict((sub, values['url']) for (section, sub), values in config.items()
+                    if section == 'remote' and sub and 'url' in values)
+
+    def head_branch(self):
+        head = (read_file(os.path.join(self.git_dir, 'HEAD')) or "").strip()
+        if not head.startswith('ref: refs/heads/'):
+            raise Exception("HEAD is detached")
+        return head[len('ref: refs/heads/'):]
+
+    def refs(self, prefix):
+        """Names of all refs below prefix, with the prefix stripped."""
+
+        if self._refs is None:
+            self._refs = self.read_refs()
+        return [r[len(prefix):] for r in self._refs if r.startswith(prefix)]
+
+    def reset(self):
+        self._refs = None
+
+    def read_refs(self):
+        refs = set()
+        packed = read_file(os.path.join(self.common_dir, 'packed-refs')) or ""
+        for line in packed.splitlines():
+            if not line or line[0] in '#^':
+                continue
+            refs.add(line.split(' ', 1)[1])
+
+        base = os.path.join(self.common_dir, 'refs')
+        for root, _dirs, files in os.walk(base):
+            rel = os.path.relpath(root, self.common_dir).replace(os.sep, '/')
+            refs.update(f"{rel}/{f}" for f in files)
+        return refs
+
+
+class RepoReader:
+    """Reader based on GitPython, used if the .git directory is not found."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = repo.working_tree_dir or repo.git_dir
+
+    def remotes(self):
+        return dict((r.name, r.url) for r in self.repo.remotes)
+
+    def head_branch(self):
+        return self.repo.head.ref.name
+
+    def refs(self, prefix):
+        return [r.path[len(prefix):] for r in self.repo.references
+                if r.path.startswith(prefix)]
+
+    def reset(self):
+        pass
+
+
+def read_file(path):
+    try:
+        with builtins.open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def parse_config(content):
+    """Parses git config files into {(section, subsection): {key: value}}.
+
+    Only the subset needed to read remotes is supported.
+    """
+
+    config = {}
+    values = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        m = re.match(r'\[\s*([\w.-]+)(?:\s+"(.*)")?\s*\]', line)
+        if m:
+            section = (m.group(1).lower(), m.group(2))
+            values = config.setdefault(section, {})
+            continue
+        if values is None or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        values[key.strip().lower()] = value
+    return config
 
 
 def github_url_owner(url):
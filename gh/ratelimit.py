@@ -0,0 +1,260 @@
+import datetime
+import threading
+import time
+
+from . import trace
+
+
+class Scheduler:
+    """Schedules API requests based on the GitHub rate limit budget.
+
+    Queries are extended with `rateLimit { cost remaining resetAt }`. Once
+    the remaining budget drops below reserve, requests are spread out
+    evenly until resetAt, and the `$count` page size of operations that
+    cost more than target_cost is reduced. Otherwise the page size of the
+    caller is kept, unless a request fails for selecting too many nodes or
+    timing out. It is then retried with half the page size, which is kept
+    for the operation. Rate limit errors are retried after backing off.
+    """
+
+    def __init__(self, target_cost=5, min_count=10, reserve=0.2, retries=5,
+                 sleep=time.sleep):
+        self.target_cost = target_cost
+        self.min_count = min_count
+        self.reserve = reserve
+        self.retries = retries
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        # page size limits per operation after too large requests
+        self._limits = {}
+        # (count, cost) of the last request per operation
+        self._costs = {}
+        self._documents = {}
+        self._not_before = 0
+
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.metrics = {
+            'requests': 0,
+            'cost': 0,
+            'retries': 0,
+            'sleep_seconds': 0.0,
+            'page_sizes': {},
+        }
+
+    def execute(self, kind, name, document, variables, fn):
+        if kind == 'query':
+            document = self.instrument(document)
+            variables = self.page_size(name, variables)
+
+        backoff = 60
+        for attempt in range(self.retries + 1):
+            self.wait()
+            try:
+                res = fn(document, variables)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                smaller = self.shrink(name, variables, e)
+                if smaller is not None:
+                    variables = smaller
+                    with self._lock:
+                        self.metrics['retries'] += 1
+                    continue
+
+                wait = rate_limit_wait(e, self.reset_at)
+                if wait is None:
+                    raise
+                wait = wait or backoff
+                backoff *= 2
+                with self._lock:
+                    self.metrics['retries'] += 1
+                    self._not_before = max(self._not_before, time.time() + wait)
+
+        if kind == 'query' and res is not None:
+            res = dict(res)
+            self.update(name, variables, res.pop('rateLimit', None))
+        return res
+
+    def instrument(self, document):
+        with self._lock:
+            entry = self._documents.get(id(document))
+        if entry is not None:
+            return entry[1]
+
+        instrumented = add_rate_limit_field(document)
+        with self._lock:
+            # keep a reference to the original, so its id is not reused
+            self._documents[id(document)] = (document, instrumented)
+        return instrumented
+
+    def page_size(self, name, variables):
+        count = variables.get('count')
+        if not count:
+            return variables
+
+        with self._lock:
+            limit = self._limits.get(name, count)
+            if self.low_budget() and name in self._costs:
+                seen_count, seen_cost = self._costs[name]
+                if seen_cost > self.target_cost:
+                    limit = min(limit, max(self.min_count, int(
+                        seen_count * self.target_cost / seen_cost)))
+            if limit >= count:
+                return variables
+            self.metrics['page_sizes'][name] = limit
+
+        variables = dict(variables)
+        variables['count'] = limit
+        return variables
+
+    def shrink(self, name, variables, err):
+        """Returns variables with half the page size if err is caused by a
+        too large request, else None."""
+
+        count = variables.get('count')
+        if not count or count <= self.min_count or not too_large(err):
+            return None
+
+        count = max(self.min_count, count // 2)
+        with self._lock:
+            self._limits[name] = min(count, self._limits.get(name, count))
+            self.metrics['page_sizes'][name] = self._limits[name]
+        variables = dict(variables)
+        variables['count'] = count
+        return variables
+
+    def low_budget(self):
+        return (self.remaining is not None and bool(self.limit)
+                and self.remaining < self.limit * self.reserve)
+
+    def update(self, name, variables, info):
+        with self._lock:
+            self.metrics['requests'] += 1
+            if not info:
+                return
+
+            cost = info.get('cost') or 1
+            trace.annotate(cost=cost, remaining=info.get('remaining'))
+            self.metrics['cost'] += cost
+            self.limit = info.get('limit', self.limit)
+            self.remaining = info.get('remaining')
+            self.reset_at = parse_time(info.get('resetAt'))
+
+            count = variables.get('count')
+            if count:
+                self._costs[name] = (count, cost)
+
+            self._not_before = max(self._not_before, self.pace(cost))
+
+    def pace(self, cost):
+        if self.remaining is None or self.reset_at is None or not self.limit:
+            return 0
+
+        now = time.time()
+        window = max(0, self.reset_at - now)
+        if self.remaining <= cost:
+            return self.reset_at + 1
+        if self.remaining > self.limit * self.reserve:
+            return 0
+
+        # spread the remaining budget evenly until reset
+        return now + window * cost / self.remaining
+
+    def wait(self):
+        with self._lock:
+            delay = self._not_before - time.time()
+            if delay > 0:
+                self.metrics['sleep_seconds'] += delay
+        if delay > 0:
+            with trace.span('rate limit wait', cat='ratelimit', seconds=delay):
+                self._sleep(delay)
+
+    def __str__(self):
+        m = self.metrics
+        sizes = ", ".join(f"{k}={v}" for k, v in sorted(m['page_sizes'].items()))
+        return (f"requests: {m['requests']}, cost: {m['cost']}, "
+                f"remaining: {self.remaining}, retries: {m['retries']}, "
+                f"slept: {m['sleep_seconds']:.1f}s, page sizes: {sizes or '-'}")
+
+
+def add_rate_limit_field(document):
+    from graphql.language.ast import Field, Name, SelectionSet, Document
+    import copy
+
+    definitions = []
+    for definition in document.definitions:
+        if getattr(definition, 'operation', None) == 'query':
+            definition = copy.copy(definition)
+            definition.selection_set = SelectionSet(
+                selections=list(definition.selection_set.selections) + [
+                    Field(name=Name(value='rateLimit'),
+                          selection_set=SelectionSet(selections=[
+                              Field(name=Name(value=f)) for f in
+                              ('limit', 'cost', 'remaining', 'resetAt')
+                          ]))
+                ])
+        definitions.append(definition)
+    return Document(definitions=definitions)
+
+
+def rate_limit_wait(err, reset_at):
+    """Returns the number of seconds to wait before retrying, 0 for the
+    default backoff, or None if err is not caused by rate limiting."""
+
+    response = getattr(err, 'response', None)
+    if response is not None and response.status_code in (403, 429):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset = response.headers.get('X-RateLimit-Reset', '')
+            if reset.isdigit():
+                return max(1, int(reset) - time.time())
+            return 0
+        # 403 is also returned for missing scopes, SSO enforcement or
+        # forbidden repositories, which must not be retried
+        if response.status_code == 429 or 'rate limit' in response_text(response):
+            return 0
+        return None
+
+    msg = str(err)
+    if 'RATE_LIMITED' in msg or 'rate limit' in msg.lower():
+        if reset_at:
+            return max(1, reset_at - time.time())
+        return 0
+    return None
+
+
+def too_large(err):
+    """Returns True if err is caused by a request selecting too many nodes
+    or timing out, so that a smaller page may succeed."""
+
+    import requests
+
+    if isinstance(err, requests.Timeout):
+        return True
+    response = getattr(err, 'response', None)
+    if response is not None and response.status_code in (502, 504):
+        return True
+
+    msg = str(err)
+    return ('MAX_NODE_LIMIT_EXCEEDED' in msg
+            or 'result of a timeout' in msg.lower())
+
+
+def response_text(response):
+    try:
+        return response.text.lower()
+    except Exception:
+        return ''
+
+
+def parse_time(s):
+    if not s:
+        return None
+    d = datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%SZ")
+    return d.replace(tzinfo=datetime.timezone.utc).timestamp()
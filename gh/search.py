@@ -0,0 +1,168 @@
+import datetime
+import sys
+
+from . import api
+from . import util
+
+
+# GitHub search never returns more than 1000 results for a query
+result_limit = 1000
+
+# lower bound for shards of queries without date range
+github_epoch = datetime.datetime(2008, 1, 1)
+
+one_second = datetime.timedelta(seconds=1)
+
+# date fields search results can be sorted by
+sortable_dates = ('created', 'updated')
+
+
+def iter_search(fn, qualifiers, date_key, since=None, until=None,
+                count=50, workers=4):
+    """Stream all search results, even if the query matches more than
+    GitHub's result limit.
+
+    If the query matches too many results, the [since, until] range on
+    date_key (created, updated, merged, closed) is split recursively until
+    each shard stays below the limit. Shards are fetched concurrently and
+    returned newest first (oldest first for `sort:*-asc` queries), without
+    duplicates.
+
+    Without a sort: qualifier, created and updated queries are sorted by
+    date_key, newest first, so all results are in date order. Search can
+    not sort by merged or closed, within a shard these results keep
+    GitHub's default order.
+
+    Shards can only be concatenated in date_key order. If the query sorts
+    by another field (e.g. `sort:comments-desc`), it is not split and
+    results stop at the limit.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if until is None:
+        until = datetime.datetime.utcnow().replace(microsecond=0)
+    if sort_field(qualifiers) is None and date_key in sortable_dates:
+        qualifiers = list(qualifiers) + [f"sort:{date_key}-desc"]
+
+    def probe(span):
+        q = list(qualifiers)
+        if span:
+            lo, hi = span
+            q.append(f"{date_key}:{fmt_date(lo)}..{fmt_date(hi)}")
+        q = " ".join(q)
+        return q, fn(count, q)
+
+    with ThreadPoolExecutor(workers) as pool:
+        span = (since, until) if since else None
+        query, first = probe(span)
+        if (first['search']['issueCount'] > result_limit and span is None
+                and sort_field(qualifiers) in (None, date_key)):
+            span = (github_epoch, until)
+            query, first = probe(span)
+
+        sort = sort_field(qualifiers)
+        if first['search']['issueCount'] <= result_limit or (
+                sort is not None and sort != date_key):
+            shards = [(span, query, first)]
+            if first['search']['issueCount'] > result_limit:
+                print(f"search matches {first['search']['issueCount']} results, "
+                      f"only the first {result_limit} are returned for sort:{sort}",
+                      file=sys.stderr)
+        else:
+            ascending = any(q.startswith('sort:') and q.endswith('-asc')
+                            for q in qualifiers)
+            shards = plan(pool, probe, span, query, first, ascending)
+
+        streams = [None] * len(shards)
+
+        def start(i):
+            if i < len(streams) and streams[i] is None:
+                _, query, first = shards[i]
+                pages = iter_shard(fn, count, query, first)
+                streams[i] = util.prefetch(pages, 1)
+
+        seen = set()
+        try:
+            for i in range(workers):
+                start(i)
+            for i in range(len(shards)):
+                start(i + workers - 1)
+                for page in streams[i]:
+                    for obj in page:
+                        node = obj['node']
+                        key = node_key(node)
+                        if key is not None:
+                            if key in seen:
+                                continue
+                            seen.add(key)
+                        yield node
+        finally:
+            for stream in streams:
+                if stream is not None:
+                    stream.close()
+
+
+def plan(pool, probe, span, query, first, ascending=False):
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    shards = []
+    pending = set()
+
+    def visit(span, query, first):
+        lo, hi = span
+        if first['search']['issueCount'] <= result_limit or hi - lo <= one_second:
+            shards.append((span, query, first))
+            return
+
+        mid = lo + (hi - lo) / 2
+        mid = mid.replace(microsecond=0)
+        for sub in ((lo, mid), (mid + one_second, hi)):
+            fut = pool.submit(probe, sub)
+            fut.span = sub
+            pending.add(fut)
+
+    visit(span, query, first)
+    while pending:
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in finished:
+            pending.remove(fut)
+            query, first = fut.result()
+            visit(fut.span, query, first)
+
+    shards.sort(key=lambda s: s[0][0], reverse=not ascending)
+    return shards
+
+
+def iter_shard(fn, count, query, first):
+    edges, cursor = api.page_edges(first, ['search', 'edges'])
+    if not edges:
+        return
+    yield edges
+    if cursor:
+        yield from api.iter_pages(fn, 'search.edges', count, query,
+                                  cursor=cursor)
+
+
+def sort_field(qualifiers):
+    """Returns the field of the sort: qualifier, or None."""
+
+    for q in qualifiers:
+        if q.startswith('sort:'):
+            field = q[len('sort:'):]
+            for suffix in ('-asc', '-desc'):
+                if field.endswith(suffix):
+                    field = field[:-len(suffix)]
+            return field
+    return None
+
+
+def node_key(node):
+    if 'repository' in node and 'number' in node:
+        r = node['repository']
+        return (r['owner']['login'], r['name'], node['number'])
+    return None
+
+
+def fmt_date(d):
+    return d.replace(microsecond=0).isoformat()
@@ -0,0 +1,28 @@
+from clidec import namespace, argument
+
+from . import api
+from . import mirror
+
+
+# sync is a top-level command. The namespace is only used to build it.
+_commands = namespace("")
+
+
+@_commands.command(
+    argument("repos", nargs="+", help="repositories (<owner>/<repo>) to mirror"),
+)
+def sync(args):
+    """Mirror issues and pull requests into the local database used by
+    --local. Only items updated since the last sync are fetched."""
+
+    client = api.from_args(args)
+    db = mirror.Mirror(args.mirror)
+    try:
+        for repo in args.repos:
+            stats = mirror.sync_repo(client, db, repo)
+            print(f"{repo}: {stats['issue']} issues, {stats['pr']} pull requests updated")
+    finally:
+        db.close()
+
+
+ns = sync
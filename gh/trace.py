@@ -0,0 +1,102 @@
+"""Timeline tracing in the Chrome trace event format.
+
+Tracing is disabled unless `start` is called. While disabled, `span` and
+`annotate` do nothing. The written file can be loaded in chrome://tracing
+or https://ui.perfetto.dev.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+_tracer = None
+
+
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name, cat, args):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        stack = self.stack()
+        stack.append(event)
+        start = time.perf_counter()
+        event['ts'] = start * 1e6
+        try:
+            yield event
+        except BaseException as e:
+            args['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            event['dur'] = (time.perf_counter() - start) * 1e6
+            stack.pop()
+            with self._lock:
+                self.events.append(event)
+
+    def annotate(self, args):
+        stack = self.stack()
+        if stack:
+            stack[-1]['args'].update(args)
+
+    def write(self):
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e['ts'])
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f,
+                      default=str)
+
+
+def start(path):
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer:
+        tracer.write()
+
+
+def enabled():
+    return _tracer is not None
+
+
+_disabled = contextlib.nullcontext()
+
+
+def span(name, cat='gh', **args):
+    """Context manager recording the time spent in the block."""
+
+    if _tracer is None:
+        return _disabled
+    return _tracer.span(name, cat, args)
+
+
+def annotate(**args):
+    """Add arguments to the innermost span of the current thread."""
+
+    if _tracer is not None:
+        _tracer.annotate(args)
@@ -0,0 +1,287 @@
+import json
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from graphql.execution import ExecutionResult
+from graphql.language.printer import print_ast
+
+from . import trace
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+
+    def add(self, **kwargs):
+        with self._lock:
+            for k, v in kwargs.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.connections)
+
+    def __str__(self):
+        return (f"requests: {self.requests}, "
+                f"connections opened: {self.connections}, "
+                f"reused: {self.reused}, "
+                f"sent: {self.bytes_sent}B, "
+                f"received: {self.bytes_received}B, "
+                f"time: {self.seconds:.3f}s")
+
+
+stats = Stats()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        stats.add(connections=1)
+        return super(CountingHTTPConnectionPool, self)._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        stats.add(connections=1)
+        return super(CountingHTTPSConnectionPool, self)._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def accept_encoding():
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli  # noqa: F401 (urllib3 decodes br if available)
+        encodings.append('br')
+    except ImportError:
+        pass
+    return ", ".join(encodings)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def shared_session(pool_size=10):
+    """Returns the process wide HTTP session.
+
+    All transports share one keep-alive connection pool. The pool size is
+    fixed by the first caller.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = PooledAdapter(pool_connections=pool_size,
+                                    pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = accept_encoding()
+            _session = session
+        return _session
+
+
+class HTTPTransport:
+    """Synchronous GraphQL transport using the shared HTTP session."""
+
+    def __init__(self, url, headers=None, timeout=30, pool_size=10):
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.session = shared_session(pool_size)
+
+    def execute(self, document, variable_values=None, timeout=None):
+        payload = {"query": print_ast(document)}
+        if variable_values:
+            payload["variables"] = variable_values
+        body = json_encode(payload)
+
+        headers = {"Content-Type": "application/json"}
+        if self.headers:
+            headers.update(self.headers)
+
+        start = time.time()
+        with trace.span('http', cat='http') as span:
+            response = self.session.post(self.url, data=body, headers=headers,
+                                         timeout=timeout or self.timeout)
+            content = response.content
+            received = response.raw.tell() or len(content)
+            if span:
+                span['args'].update(status=response.status_code,
+                                    bytes_sent=len(body),
+                                    bytes_received=received)
+        stats.add(requests=1,
+                  bytes_sent=len(body),
+                  bytes_received=received,
+                  seconds=time.time() - start)
+
+        try:
+            result = response.json()
+            if not isinstance(result, dict):
+                raise ValueError
+        except ValueError:
+            result = {}
+
+        if "errors" not in result and "data" not in result:
+            response.raise_for_status()
+            raise requests.HTTPError(
+                "Server did not return a GraphQL result", response=response)
+        return ExecutionResult(errors=result.get("errors"),
+                               data=result.get("data"))
+
+    def close(self):
+        pass
+
+
+def json_encode(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+class CassetteTransport:
+    """Records GraphQL requests and responses to a cassette file, or
+    replays them without network access.
+
+    Cassettes are JSON lines, one interaction per line. On replay,
+    requests are matched by operation name and variables. Repeated requests
+    are answered in recorded order. Requests whose variables only differ
+    from the recording in dates and times (e.g. search date qualifiers
+    computed from the current time) get the next unused response recorded
+    with the same variables otherwise. latency selects the replay delay:
+    None to answer immediately, 'recorded' to wait as long as the original
+    request took, or a fixed number of seconds.
+    """
+
+    def __init__(self, path, transport=None, latency=None):
+        self.path = path
+        self.transport = transport
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._entries = None
+        self._undated = None
+        self._used = set()
+        if transport is None:
+            self._entries, self._undated = load_cassette(path)
+
+    @property
+    def recording(self):
+        return self.transport is not None
+
+    def execute(self, document, variable_values=None, timeout=None):
+        key = cassette_key(document, variable_values)
+        if self.recording:
+            return self.record(key, document, variable_values, timeout)
+        return self.replay(key)
+
+    def record(self, key, document, variable_values, timeout):
+        start = time.time()
+        result = self.transport.execute(document, variable_values, timeout)
+        entry = {
+            'operation': key[0],
+            'variables': variable_values or {},
+            'seconds': round(time.time() - start, 6),
+            'data': result.data,
+            'errors': result.errors,
+        }
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+        return result
+
+    def replay(self, key):
+        with self._lock:
+            entry = (self._take(self._entries.get(key)) or
+                     self._take(self._undated.get(undated_key(key))))
+            if entry is None:
+                raise Exception(
+                    f"no recorded response for {key[0]} with variables {key[1]}")
+
+        delay = self.latency
+        if delay == 'recorded':
+            delay = entry.get('seconds', 0)
+        if delay:
+            time.sleep(delay)
+
+        body = json.dumps(entry)
+        stats.add(requests=1, bytes_received=len(body),
+                  seconds=delay or 0)
+        return ExecutionResult(errors=entry.get('errors'),
+                               data=entry.get('data'))
+
+    def _take(self, queue):
+        """Returns the first unused entry of queue. Once all entries are
+        used, the last one answers requests repeated more often."""
+
+        if not queue:
+            return None
+        for entry in queue:
+            if id(entry) not in self._used:
+                self._used.add(id(entry))
+                return entry
+        return queue[-1]
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+
+# dates and times in variables, e.g. 'updated:2020-01-02T03:04:05..'
+date_pattern = re.compile(r"\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?")
+
+
+def undated_key(key):
+    return key[0], date_pattern.sub("<date>", key[1])
+
+
+def cassette_key(document, variables):
+    name = None
+    for definition in document.definitions:
+        if getattr(definition, 'operation', None):
+            name = definition.name.value if definition.name else None
+            break
+    return name, json.dumps(variables or {}, sort_keys=True)
+
+
+def load_cassette(path):
+    """Returns the recorded entries by (operation, variables), and by
+    operation and variables with dates replaced."""
+
+    entries, undated = {}, {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            key = (entry['operation'],
+                   json.dumps(entry['variables'], sort_keys=True))
+            entries.setdefault(key, []).append(entry)
+            undated.setdefault(undated_key(key), []).append(entry)
+    return entries, undated
+
+
+def replay_latency(value):
+    """Parses the --replay-latency option: 'none', 'recorded' or
+    milliseconds."""
+
+    if value in (None, '', 'none'):
+        return None
+    if value == 'recorded':
+        return value
+    return float(value) / 1000
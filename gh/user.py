@@ -6,6 +6,9 @@ from clidec import namespace, command_name, argument
 from . import project
 from . import api
 from . import fmt
+from . import metadata
+from . import mirror
+from . import search
 
 from .util import parse_timedelta
 
@@ -23,12 +26,25 @@ ns = namespace("user")
              help="list issue with updates since today-<last>"),
     argument("--sort", default="",
              help='issue order (<field>-<direction>)'),
+    argument("--local", default=False, action='store_true',
+             help="answer from the local mirror (see gh sync)"),
 )
 def interactions(args):
-    client = api.client(args.token)
+    if args.local:
+        user = args.user
+        if not user:
+            store = metadata.Metadata(metadata.default_path(args.cache_dir), None)
+            user = store.stored_viewer_login()
+        if not user:
+            print("user required with --local, no viewer login is stored yet")
+            return
+        local_interactions(args, user)
+        return
+
+    client = api.from_args(args)
     user = args.user
     if not user:
-        user = client.query_viewer_login()['viewer']['login']
+        user = client.metadata.viewer_login()
 
     query = [f"involves:{user}"]
     if args.state and args.state != "all":
@@ -39,27 +55,45 @@ def interactions(args):
     if args.org:
         query += [f"org:{args.org}"]
 
+    since = None
     if args.last:
         delta = parse_timedelta(args.last)
         since = datetime.datetime.utcnow() - delta
-        query += [f"updated:{since.replace(microsecond=0).isoformat()}..*"]
 
     if args.sort:
         query += [f"sort:{args.sort}"]
 
-    iter_issues = api.iter_gql(client.query_user_issues_search, 'search.edges',
-            50, " ".join(["type:issue"] + query))
-    for issue in iter_issues:
-        try:
-            fmt.issue_info(issue)
-        finally:
-            print("\n")
-
-    iter_prs = api.iter_gql(client.query_user_prs_search, 'search.edges',
-            50, " ".join(["type:pr"] + query))
-    for pr in iter_prs:
-        try:
-            fmt.pr_info(pr)
-        finally:
-            print("\n")
+    with fmt.renderer(args.format, sep="\n\n") as render:
+        iter_issues = search.iter_search(client.query_user_issues_search,
+                ["type:issue"] + query, 'updated', since)
+        for issue in iter_issues:
+            render.issue(issue)
+
+        iter_prs = search.iter_search(client.query_user_prs_search,
+                ["type:pr"] + query, 'updated', since)
+        for pr in iter_prs:
+            render.pr(pr)
+
+
+
+def local_interactions(args, user):
+    states = {
+        "open": (["OPEN"], ["OPEN"]),
+        "closed": (["CLOSED"], ["CLOSED", "MERGED"]),
+    }
+    issue_states, pr_states = states.get(args.state, (None, None))
+
+    since = None
+    if args.last:
+        delta = parse_timedelta(args.last)
+        since = mirror.format_time(datetime.datetime.utcnow() - delta)
 
+    labels = args.labels.split(',') if args.labels else None
+    db = mirror.Mirror(args.mirror)
+    with fmt.renderer(args.format, sep="\n\n") as render:
+        for kind, states in (('issue', issue_states), ('pr', pr_states)):
+            items = db.query(kind, states=states, labels=labels,
+                             involves=user, org=args.org, since=since)
+            write = render.pr if kind == 'pr' else render.issue
+            for item in items:
+                write(item)
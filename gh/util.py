@@ -1,5 +1,7 @@
 import re
 import datetime
+import queue
+import threading
 
 timedeltaRegex = re.compile(r'((?P<days>\d+?)d)((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
 
@@ -13,3 +15,65 @@ def parse_timedelta(delta_str):
         if param:
             params[name] = int(param)
     return datetime.timedelta(**params)
+
+
+def prefetch(iterable, lookahead=1):
+    """Consume iterable in a background thread, staying at most lookahead
+    items ahead of the caller. Exceptions are re-raised in the caller."""
+
+    return Prefetch(iterable, lookahead)
+
+
+class Prefetch:
+    def __init__(self, iterable, lookahead=1):
+        self._queue = queue.Queue(maxsize=lookahead)
+        self._stop = threading.Event()
+        self._finished = False
+        # the thread must not reference self, so that abandoned iterators
+        # are collected and stop the producer
+        threading.Thread(target=produce, daemon=True,
+                         args=(iterable, self._queue, self._stop)).start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item, err = self._queue.get()
+        if item is done:
+            self.close()
+            if err:
+                raise err
+            raise StopIteration
+        return item
+
+    def close(self):
+        self._finished = True
+        self._stop.set()
+
+    def __del__(self):
+        self._stop.set()
+
+
+done = object()
+
+
+def produce(iterable, q, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for item in iterable:
+            if not put((item, None)):
+                return
+    except BaseException as e:
+        put((done, e))
+        return
+    put((done, None))